@@ -0,0 +1,166 @@
+import importlib
+import logging
+import os
+import threading
+from bisect import bisect_left
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+from config import (
+    DEFAULT_INFERENCE_BACKEND,
+    INFERENCE_BACKENDS,
+    TFLITE_BATCH_SIZES,
+    TFLITE_NUM_THREADS,
+    TFLITE_VARIANTS
+)
+from utils import get_model_path, get_tflite_path, tf
+
+logger = logging.getLogger(__name__)
+
+BACKEND_NAMES = ("keras",) + tuple(f"tflite-{variant}" for variant in TFLITE_VARIANTS)
+
+
+class InferenceBackend:
+    """Forward pass of one model over a stacked (batch, H, W, C) float32 array"""
+
+    name = "base"
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        """Return the (batch, classes) probabilities"""
+        raise NotImplementedError
+
+    @property
+    def size_bytes(self) -> int:
+        """Size of the model file"""
+        return 0
+
+    @property
+    def memory_bytes(self) -> int:
+        """Memory the loaded model takes: weights, plus buffers where the runtime allocates them"""
+        return 0
+
+
+class KerasBackend(InferenceBackend):
+    """Full-precision Keras model"""
+
+    name = "keras"
+
+    def __init__(self, model, path: Optional[str] = None):
+        self.model = model
+        self.path = path
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        return np.asarray(self.model.predict_on_batch(batch))
+
+    @property
+    def size_bytes(self) -> int:
+        return os.path.getsize(self.path) if self.path and os.path.exists(self.path) else 0
+
+    @property
+    def memory_bytes(self) -> int:
+        return int(sum(np.prod(w.shape) * np.dtype(w.dtype).itemsize for w in self.model.weights))
+
+
+def _interpreter_class():
+    # Prefer the standalone LiteRT runtimes; TensorFlow's own interpreter is the fallback
+    for module_name in ('ai_edge_litert.interpreter', 'tflite_runtime.interpreter'):
+        try:
+            return importlib.import_module(module_name).Interpreter
+        except ImportError:
+            continue
+    return tf.lite.Interpreter
+
+
+class TFLiteBackend(InferenceBackend):
+    """Converted (float16 or int8 quantized) model run by a TFLite interpreter
+
+    One interpreter is shared by every caller, so calls are serialized.
+    Resizing and reallocating it for every new micro-batch size costs more
+    than the quantized forward pass saves, so batches are zero-padded up to
+    the next size in ``batch_sizes`` and the interpreter is only resized when
+    that size changes; larger batches run in chunks of the largest size.
+    """
+
+    def __init__(self, path: str, variant: str, num_threads: int = TFLITE_NUM_THREADS,
+                 batch_sizes: Sequence[int] = TFLITE_BATCH_SIZES):
+        self.path = path
+        self.name = f"tflite-{variant}"
+        self.batch_sizes = tuple(sorted(set(batch_sizes)))
+        self._interpreter = _interpreter_class()(model_path=path, num_threads=num_threads)
+        self._lock = threading.Lock()
+        self._batch_size = None
+        self._resize(self.batch_sizes[0])
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        largest = self.batch_sizes[-1]
+        if len(batch) > largest:
+            return np.concatenate([self.predict(batch[start:start + largest])
+                                   for start in range(0, len(batch), largest)])
+
+        size = self.batch_sizes[bisect_left(self.batch_sizes, len(batch))]
+        with self._lock:
+            if size != self._batch_size:
+                self._resize(size)
+            inputs = self._quantize(batch, self._input)
+            if len(inputs) < size:
+                inputs = np.concatenate([inputs, np.zeros((size - len(inputs),) + inputs.shape[1:], inputs.dtype)])
+            self._interpreter.set_tensor(self._input['index'], inputs)
+            self._interpreter.invoke()
+            outputs = self._interpreter.get_tensor(self._output['index'])[:len(batch)]
+            return self._dequantize(outputs, self._output)
+
+    @property
+    def size_bytes(self) -> int:
+        return os.path.getsize(self.path)
+
+    @property
+    def memory_bytes(self) -> int:
+        return self._memory_bytes
+
+    def _resize(self, size: int):
+        input_details = self._interpreter.get_input_details()[0]
+        if int(input_details['shape'][0]) != size:
+            self._interpreter.resize_tensor_input(input_details['index'], [size, *input_details['shape'][1:]])
+        self._interpreter.allocate_tensors()
+        self._input = self._interpreter.get_input_details()[0]
+        self._output = self._interpreter.get_output_details()[0]
+        self._batch_size = size
+        # Weights plus the activation buffers of the current allocation
+        self._memory_bytes = int(sum(np.prod(tensor['shape']) * np.dtype(tensor['dtype']).itemsize
+                                     for tensor in self._interpreter.get_tensor_details()))
+
+    @staticmethod
+    def _quantize(batch: np.ndarray, details: Dict) -> np.ndarray:
+        dtype = details['dtype']
+        if dtype == np.float32:
+            return np.ascontiguousarray(batch, dtype=np.float32)
+        # Integer inputs (fully quantized models) take scaled and shifted values
+        scale, zero_point = details['quantization']
+        info = np.iinfo(dtype)
+        return np.clip(np.round(batch / scale + zero_point), info.min, info.max).astype(dtype)
+
+    @staticmethod
+    def _dequantize(output: np.ndarray, details: Dict) -> np.ndarray:
+        if output.dtype == np.float32:
+            return output.copy()
+        scale, zero_point = details['quantization']
+        return (output.astype(np.float32) - zero_point) * scale
+
+
+def backend_name(model_name: str) -> str:
+    """Configured backend of a model"""
+    return INFERENCE_BACKENDS.get(model_name, DEFAULT_INFERENCE_BACKEND)
+
+
+def backend_path(model_name: str, name: str) -> str:
+    """Model file a backend runs"""
+    if name == "keras":
+        return get_model_path(model_name)
+    return get_tflite_path(model_name, name[len("tflite-"):])
+
+
+def load_tflite_backend(model_name: str, name: str) -> TFLiteBackend:
+    if name not in BACKEND_NAMES or name == "keras":
+        raise ValueError(f"Unknown TFLite backend '{name}'")
+    return TFLiteBackend(backend_path(model_name, name), name[len("tflite-"):])
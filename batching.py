@@ -0,0 +1,153 @@
+import logging
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+from typing import Callable, Dict
+
+import numpy as np
+
+from config import INFERENCE_MAX_BATCH_SIZE, INFERENCE_MAX_QUEUE, INFERENCE_MAX_WAIT_MS
+from executors import ServiceOverloaded
+from metrics import metrics, stage
+from model_registry import registry
+
+logger = logging.getLogger(__name__)
+
+batch_sizes = metrics.histogram("inference_batch_size", "Images per micro-batched model call", ("scheduler",),
+                                buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+
+_STOP = object()
+
+
+class InferenceScheduler:
+    """Gather concurrent single-image requests into batches for one model
+
+    ``batch_fn`` receives a stacked (batch, H, W, C) array and returns a tuple of
+    arrays whose first axis is the batch; each caller gets its own row of every
+    array through the future returned by ``submit``.
+    """
+
+    def __init__(self, name: str, batch_fn: Callable, max_batch_size: int = INFERENCE_MAX_BATCH_SIZE,
+                 max_wait_ms: float = INFERENCE_MAX_WAIT_MS, max_queue: int = INFERENCE_MAX_QUEUE):
+        self.name = name
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_queue = max_queue
+        self._queue: "queue.Queue" = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._max_queue_depth = 0
+        self._worker = threading.Thread(target=self._run, name=f"inference-{name}", daemon=True)
+        self._worker.start()
+
+    def submit(self, image_array: np.ndarray) -> Future:
+        """Queue one (H, W, C) image and return a future for its outputs"""
+        if self._queue.qsize() >= self.max_queue:
+            raise ServiceOverloaded(f"inference-{self.name}")
+        future = Future()
+        self._queue.put((image_array, future))
+        with self._stats_lock:
+            self._max_queue_depth = max(self._max_queue_depth, self._queue.qsize())
+        return future
+
+    def stats(self) -> Dict:
+        """Return queue depth and batch size statistics"""
+        with self._stats_lock:
+            batches = sum(self._batch_sizes.values())
+            items = sum(size * count for size, count in self._batch_sizes.items())
+            return {
+                'queue_depth': self._queue.qsize(),
+                'max_queue_depth': self._max_queue_depth,
+                'batches': batches,
+                'items': items,
+                'avg_batch_size': round(items / batches, 2) if batches else 0.0,
+                'batch_size_histogram': dict(sorted(self._batch_sizes.items())),
+            }
+
+    def close(self):
+        """Stop the worker after the already queued requests are served"""
+        self._queue.put(_STOP)
+        self._worker.join()
+
+    def _collect(self):
+        item = self._queue.get()
+        if item is _STOP:
+            return None, True
+        batch = [item]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch, stopping = self._collect()
+            if not batch:
+                continue
+            # Skip requests whose callers have already given up
+            pending = [(image, future) for image, future in batch if future.set_running_or_notify_cancel()]
+            if not pending:
+                continue
+            images, futures = zip(*pending)
+            with self._stats_lock:
+                self._batch_sizes[len(futures)] += 1
+            batch_sizes.observe(len(futures), scheduler=self.name)
+            try:
+                with stage("batch_inference", model=self.name):
+                    outputs = self.batch_fn(np.stack(images))
+            except Exception as e:
+                logger.exception("Batch inference failed for '%s'", self.name)
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            for row, future in enumerate(futures):
+                future.set_result(tuple(output[row] for output in outputs))
+
+
+class SchedulerPool:
+    """Lazily create one inference scheduler per model"""
+
+    def __init__(self):
+        self._schedulers: Dict[str, InferenceScheduler] = {}
+        self._lock = threading.Lock()
+
+    def get(self, model_name: str, explain: bool = True) -> InferenceScheduler:
+        """Scheduler of a model; with ``explain`` its results include raw Grad-CAM heatmaps"""
+        key = model_name if explain else f"{model_name}:classify"
+        with self._lock:
+            scheduler = self._schedulers.get(key)
+            if scheduler is None:
+                if explain:
+                    # Predictions and raw Grad-CAM heatmaps from the model's cached engine
+                    batch_fn = lambda batch: registry.get_gradcam_engine(model_name)(batch)
+                else:
+                    # Forward pass only, through the model's configured backend
+                    batch_fn = lambda batch: (registry.get_backend(model_name).predict(batch),)
+                scheduler = InferenceScheduler(key, batch_fn)
+                self._schedulers[key] = scheduler
+            return scheduler
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {name: scheduler.stats() for name, scheduler in self._schedulers.items()}
+
+    def shutdown(self):
+        with self._lock:
+            schedulers, self._schedulers = list(self._schedulers.values()), {}
+        for scheduler in schedulers:
+            scheduler.close()
+
+
+# Global scheduler pool instance
+schedulers = SchedulerPool()
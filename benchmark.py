@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark suite for the inference and storage hot paths.
+
+Everything runs on CPU without trained weights: uploads are synthetic JPEGs,
+models are small randomly initialized CNNs with the application's input size
+and the head size of each model in CLASS_NAMES, and the database is generated
+with the requested number of rows (and reused by later runs).
+
+    python benchmark.py --output baseline.json
+    python benchmark.py --baseline baseline.json --fail-on-regression
+    python benchmark.py --stages db --db-rows 1000000
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import numpy as np
+from PIL import Image
+
+from config import CLASS_NAMES, IMG_SIZE
+from preprocessing import make_thumbnail, preprocess_image
+from utils import HEATMAP_FORMATS, GradCamEngine, apply_heatmap, encode_heatmap, normalize_heatmap, tf
+
+GENERATE_CHUNK_SIZE = 50000
+
+
+def synthetic_jpeg(seed, size=(640, 480)):
+    """Random image encoded like a camera upload"""
+    rng = np.random.default_rng(seed)
+    # Upscaled low-resolution noise compresses like a photo rather than like white noise
+    small = rng.integers(0, 255, (size[1] // 16, size[0] // 16, 3), dtype=np.uint8)
+    image = Image.fromarray(small).resize(size, Image.BICUBIC)
+    output = io.BytesIO()
+    image.save(output, format='JPEG', quality=90)
+    return output.getvalue()
+
+
+def random_cnn(num_classes, seed):
+    """Small randomly initialized CNN taking IMG_SIZE images and returning num_classes probabilities"""
+    tf.keras.utils.set_random_seed(seed)
+    layers = tf.keras.layers
+    return tf.keras.Sequential([
+        tf.keras.Input(shape=tuple(IMG_SIZE) + (3,)),
+        layers.Conv2D(16, 3, activation='relu', padding='same'),
+        layers.MaxPooling2D(),
+        layers.Conv2D(32, 3, activation='relu', padding='same'),
+        layers.MaxPooling2D(),
+        layers.Conv2D(64, 3, activation='relu', padding='same'),
+        layers.GlobalAveragePooling2D(),
+        layers.Dense(num_classes, activation='softmax'),
+    ])
+
+
+def generate_database(work_dir, rows, seed):
+    """Open the benchmark database of ``rows`` predictions, generating missing rows"""
+    # Imported here, inside the work directory, so the module's global database
+    # is created there rather than next to the application's
+    from database import PredictionDatabase
+
+    path = os.path.join(work_dir, f"benchmark-{rows}.db")
+    database = PredictionDatabase(path, blob_dir=os.path.join(work_dir, 'blobs'))
+    with database.pool.connection() as conn:
+        existing = conn.execute('SELECT COUNT(*) FROM predictions').fetchone()[0]
+        if existing >= rows:
+            return database
+
+        rng = random.Random(seed + existing)
+        models = list(CLASS_NAMES.keys())
+        start = datetime(2024, 1, 1)
+        for first in range(existing, rows, GENERATE_CHUNK_SIZE):
+            batch = []
+            for i in range(first, min(first + GENERATE_CHUNK_SIZE, rows)):
+                model_name = rng.choice(models)
+                batch.append((
+                    start + timedelta(seconds=rng.randrange(365 * 86400)),
+                    model_name,
+                    rng.choice(CLASS_NAMES[model_name]),
+                    rng.uniform(0, 100),
+                    f"image_{i}.jpg",
+                    rng.randrange(20000, 5000000),
+                    'image/jpeg',
+                ))
+            conn.executemany('''
+                INSERT INTO predictions (timestamp, model_name, predicted_class, confidence,
+                                         file_name, file_size, file_type)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', batch)
+            conn.commit()
+            done = first + len(batch)
+            print(f"\rGenerating {path}: {done}/{rows}", end="\n" if done >= rows else "", flush=True)
+    return database
+
+
+def time_stage(fn, runs, warmup, items=1):
+    """Latency percentiles, throughput and Python heap peak of a callable"""
+    for _ in range(warmup):
+        fn()
+
+    latencies = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - started)
+
+    # Memory is traced during one extra call since tracing would distort the timings
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    ms = np.array(latencies) * 1000
+    return {
+        'runs': runs,
+        'items_per_call': items,
+        'p50_ms': round(float(np.percentile(ms, 50)), 4),
+        'p95_ms': round(float(np.percentile(ms, 95)), 4),
+        'p99_ms': round(float(np.percentile(ms, 99)), 4),
+        'mean_ms': round(float(ms.mean()), 4),
+        'throughput_per_s': round(items * 1000 / float(ms.mean()), 2),
+        'peak_python_mb': round(peak / 1024 / 1024, 3),
+    }
+
+
+def image_stages(args):
+    """Decoding and heatmap rendering of one upload"""
+    contents = synthetic_jpeg(args.seed)
+    image_array = preprocess_image(contents)
+    rng = np.random.default_rng(args.seed)
+    raw_heatmap = rng.random((1, IMG_SIZE[1] // 4, IMG_SIZE[0] // 4), dtype=np.float32)
+    overlay = apply_heatmap(image_array[np.newaxis], normalize_heatmap(raw_heatmap))[0]
+
+    yield 'image/decode', lambda: preprocess_image(contents), 1
+    yield 'image/thumbnail', lambda: make_thumbnail(contents), 1
+    yield 'image/heatmap_overlay', lambda: apply_heatmap(image_array[np.newaxis], normalize_heatmap(raw_heatmap)), 1
+    for image_format in HEATMAP_FORMATS:
+        yield f'image/heatmap_encode/{image_format.lower()}', lambda: encode_heatmap(overlay, image_format), 1
+
+
+def model_stages(args):
+    """Forward passes and Grad-CAM of every model head"""
+    rng = np.random.default_rng(args.seed)
+    single = rng.random((1,) + tuple(IMG_SIZE) + (3,), dtype=np.float32)
+    batch = rng.random((args.batch_size,) + tuple(IMG_SIZE) + (3,), dtype=np.float32)
+
+    for index, model_name in enumerate(args.models or CLASS_NAMES.keys()):
+        model = random_cnn(len(CLASS_NAMES[model_name]), args.seed + index)
+        engine = GradCamEngine(model)
+        yield f'model/predict/{model_name}', lambda: model.predict_on_batch(single), 1
+        yield f'model/predict_batch/{model_name}', lambda: model.predict_on_batch(batch), args.batch_size
+        yield f'model/gradcam/{model_name}', lambda: engine(single), 1
+        yield f'model/gradcam_batch/{model_name}', lambda: engine(batch), args.batch_size
+
+
+def db_stages(args):
+    """Writes and the read queries behind the history and statistics pages"""
+    database = generate_database(args.work_dir, args.db_rows, args.seed)
+    with database.pool.connection() as conn:
+        last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM predictions').fetchone()[0]
+
+    record = {
+        'model_name': 'Apple',
+        'predicted_class': 'Apple - Healthy',
+        'confidence': 97.5,
+        'file_name': 'benchmark.jpg',
+        'file_size': 123456,
+        'file_type': 'image/jpeg',
+    }
+    try:
+        yield 'db/save_prediction', lambda: database.save_prediction(**record), 1
+        yield 'db/save_predictions', lambda: database.save_predictions([dict(record)] * args.batch_size), args.batch_size
+        yield 'db/statistics', database.get_prediction_statistics, 1
+        yield 'db/timeseries', database.get_prediction_timeseries, 1
+        yield 'db/history_page', lambda: database.get_prediction_history(limit=50), 1
+        yield 'db/history_filtered', lambda: database.get_prediction_history(limit=50, model_name='Apple',
+                                                                            min_confidence=50), 1
+    finally:
+        # Leave the generated database as it was so later runs measure the same data
+        with database.pool.connection() as conn:
+            conn.execute('DELETE FROM predictions WHERE id > ?', (last_id,))
+            conn.commit()
+        database.pool.close_all()
+
+
+STAGE_GROUPS = {
+    'image': image_stages,
+    'model': model_stages,
+    'db': db_stages,
+}
+
+
+def max_rss_mb():
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024, 1)
+
+
+def run(args):
+    results = {
+        'meta': {
+            'started_at': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+            'cpu_count': os.cpu_count(),
+            'numpy': np.__version__,
+            'img_size': list(IMG_SIZE),
+            'runs': args.runs,
+            'warmup': args.warmup,
+            'batch_size': args.batch_size,
+            'db_rows': args.db_rows,
+            'seed': args.seed,
+        },
+        'stages': {},
+    }
+    for group in args.stages:
+        for name, fn, items in STAGE_GROUPS[group](args):
+            results['stages'][name] = time_stage(fn, args.runs, args.warmup, items)
+            stage = results['stages'][name]
+            print(f"{name:<36} p50 {stage['p50_ms']:>9.3f} ms  p95 {stage['p95_ms']:>9.3f} ms  "
+                  f"{stage['throughput_per_s']:>10.1f}/s  heap {stage['peak_python_mb']:>7.2f} MB")
+    if tf.loaded:
+        results['meta']['tensorflow'] = tf.__version__
+    results['max_rss_mb'] = max_rss_mb()
+    print(f"Peak resident memory: {results['max_rss_mb']} MB")
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Print p50 changes against a baseline and return the stages slower than the tolerance"""
+    if baseline['meta'].get('platform') != results['meta']['platform']:
+        print(f"⚠️  Baseline was recorded on {baseline['meta'].get('platform')}; timings may not be comparable")
+
+    regressions = []
+    print(f"{'stage':<36} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name, stage in results['stages'].items():
+        reference = baseline['stages'].get(name)
+        if reference is None:
+            continue
+        change = stage['p50_ms'] / reference['p50_ms'] - 1 if reference['p50_ms'] else 0.0
+        marker = ""
+        if change > tolerance:
+            regressions.append(name)
+            marker = "  ⚠️  slower"
+        print(f"{name:<36} {reference['p50_ms']:>10.3f} {stage['p50_ms']:>10.3f} {change:>+8.1%}{marker}")
+    return regressions
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the inference and storage hot paths")
+    parser.add_argument("--stages", nargs="+", choices=list(STAGE_GROUPS), default=list(STAGE_GROUPS),
+                        help="stage groups to run (default: all)")
+    parser.add_argument("--models", nargs="+", choices=list(CLASS_NAMES), metavar="NAME",
+                        help="model heads to benchmark (default: all)")
+    parser.add_argument("--runs", type=int, default=50, help="timed calls per stage (default: 50)")
+    parser.add_argument("--warmup", type=int, default=5, help="untimed calls per stage first (default: 5)")
+    parser.add_argument("--batch-size", type=int, default=16, help="images or rows of batched stages (default: 16)")
+    parser.add_argument("--db-rows", type=int, default=10000, help="predictions in the generated database "
+                                                                   "(default: 10000)")
+    parser.add_argument("--work-dir", default=os.path.join(tempfile.gettempdir(), "favdd-benchmark"),
+                        help="where generated databases are kept between runs")
+    parser.add_argument("--seed", type=int, default=0, help="seed of every synthetic input (default: 0)")
+    parser.add_argument("--output", metavar="PATH", help="write the results as JSON")
+    parser.add_argument("--baseline", metavar="PATH", help="compare with results saved by an earlier run")
+    parser.add_argument("--tolerance", type=float, default=0.10,
+                        help="p50 slowdown reported as a regression (default: 0.10)")
+    parser.add_argument("--fail-on-regression", action="store_true",
+                        help="exit with status 1 when a stage regressed")
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    args.work_dir = os.path.abspath(args.work_dir)
+    os.makedirs(args.work_dir, exist_ok=True)
+    output = os.path.abspath(args.output) if args.output else None
+    os.chdir(args.work_dir)
+
+    results = run(args)
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {output}")
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} stages regressed by more than {args.tolerance:.0%}")
+            if args.fail_on_regression:
+                sys.exit(1)
@@ -0,0 +1,156 @@
+import base64
+import hashlib
+import os
+import re
+import tempfile
+from typing import List, Optional, Tuple
+
+_DIGEST_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+def is_valid_digest(digest: str) -> bool:
+    """Check that a string is a lowercase hex SHA-256 digest"""
+    return bool(digest) and _DIGEST_RE.match(digest) is not None
+
+
+def blob_url(digest: Optional[str]) -> Optional[str]:
+    """URL under which the application serves a blob"""
+    return f"/blobs/{digest}" if digest else None
+
+
+def parse_data_url(data_url: str) -> Tuple[str, bytes]:
+    """Split a base64 data URL into (content type, raw bytes)"""
+    header, _, payload = data_url.partition(',')
+    content_type = header[len('data:'):].split(';')[0] if header.startswith('data:') else ''
+    return content_type or 'application/octet-stream', base64.b64decode(payload)
+
+
+class BlobStore:
+    """Content-addressed files on disk, sharded into two directory levels
+
+    A blob is stored once under ``<root>/<d[0:2]>/<d[2:4]>/<d>`` where ``d`` is
+    the SHA-256 of its bytes; its content type and size are recorded in the
+    ``blobs`` table of the owning database.
+    """
+
+    def __init__(self, root: str, database):
+        self.root = root
+        self.db = database
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[0:2], digest[2:4], digest)
+
+    def put(self, data: bytes, content_type: str) -> str:
+        """Store bytes (once per distinct content), record their type and return their digest"""
+        digest = self.write(data)
+        self.db.register_blob(digest, content_type, len(data))
+        return digest
+
+    def put_many(self, blobs: List[Tuple[bytes, str]]) -> List[str]:
+        """Store several (bytes, content type) blobs, recording them in one transaction"""
+        digests = [self.write(data) for data, _ in blobs]
+        self.db.register_blobs([(digest, content_type, len(data))
+                                for digest, (data, content_type) in zip(digests, blobs)])
+        return digests
+
+    def write(self, data: bytes) -> str:
+        """Write the blob file if it does not exist yet and return its digest"""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temporary file first so readers never see a partial blob
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        return digest
+
+    def put_data_url(self, data_url: Optional[str]) -> Optional[str]:
+        """Store the payload of a base64 data URL and return its digest"""
+        if not data_url:
+            return None
+        content_type, data = parse_data_url(data_url)
+        return self.put(data, content_type)
+
+    def get(self, digest: str) -> Optional[bytes]:
+        if not is_valid_digest(digest):
+            return None
+        try:
+            with open(self.path(digest), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def file_path(self, digest: str) -> Optional[str]:
+        """Path of the file holding a blob, None when it is not kept in a file"""
+        if is_valid_digest(digest) and os.path.exists(self.path(digest)):
+            return self.path(digest)
+        return None
+
+    def exists(self, digest: str) -> bool:
+        return is_valid_digest(digest) and os.path.exists(self.path(digest))
+
+    def delete(self, digest: str) -> bool:
+        """Remove a blob file; the caller is responsible for its references"""
+        if not is_valid_digest(digest):
+            return False
+        try:
+            os.remove(self.path(digest))
+            return True
+        except FileNotFoundError:
+            return False
+
+
+class SqliteBlobStore(BlobStore):
+    """Blobs kept as BLOB values in the ``blob_data`` table of the owning database
+
+    Saves the per-blob file create/fsync and directory fan-out for small
+    images; blobs written as files by earlier versions are still read and
+    deleted from ``root``.
+    """
+
+    def put(self, data: bytes, content_type: str) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        self.db.save_blob_data(digest, content_type, data)
+        return digest
+
+    def put_many(self, blobs: List[Tuple[bytes, str]]) -> List[str]:
+        digests = [hashlib.sha256(data).hexdigest() for data, _ in blobs]
+        self.db.save_blobs_data([(digest, content_type, data)
+                                 for digest, (data, content_type) in zip(digests, blobs)])
+        return digests
+
+    def get(self, digest: str) -> Optional[bytes]:
+        if not is_valid_digest(digest):
+            return None
+        data = self.db.get_blob_data(digest)
+        return data if data is not None else super().get(digest)
+
+    def exists(self, digest: str) -> bool:
+        return super().exists(digest) or (is_valid_digest(digest) and self.db.has_blob_data(digest))
+
+    def delete(self, digest: str) -> bool:
+        if not is_valid_digest(digest):
+            return False
+        deleted = self.db.delete_blob_data(digest)
+        return super().delete(digest) or deleted
+
+
+# Blob store implementations selectable with BLOB_STORE_BACKEND
+BLOB_STORE_BACKENDS = {
+    'files': BlobStore,
+    'sqlite': SqliteBlobStore,
+}
+
+
+def create_blob_store(backend: str, root: str, database) -> BlobStore:
+    """Create the blob store of a database for a backend name"""
+    try:
+        return BLOB_STORE_BACKENDS[backend](root, database)
+    except KeyError:
+        raise ValueError(f"Unknown blob store backend: {backend}") from None
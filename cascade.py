@@ -0,0 +1,66 @@
+import os
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from config import CASCADE_CONFIDENCE_THRESHOLD, CASCADE_FIRST_MODEL, CASCADE_SPECIALISTS, CLASS_NAMES
+from utils import get_model_path
+
+
+def stage_result(model_name: str, probabilities: np.ndarray) -> Dict:
+    """One cascade stage: the model and its top class (None when the index has no label)"""
+    class_index = int(np.argmax(probabilities))
+    class_labels = CLASS_NAMES[model_name]
+    return {
+        'model': model_name,
+        'predicted_class': class_labels[class_index] if class_index < len(class_labels) else None,
+        'confidence': float(np.max(probabilities) * 100),
+    }
+
+
+def _covers(model_name: str, predicted_class: str) -> bool:
+    """Whether a model can tell conditions apart and knows the predicted one"""
+    class_labels = CLASS_NAMES[model_name]
+    condition = predicted_class.split(' - ', 1)[-1]
+    return len(class_labels) > 1 and any(label.split(' - ', 1)[-1] == condition for label in class_labels)
+
+
+def specialist_for(stage: Dict) -> Optional[str]:
+    """Specialist model to consult after a first-stage result, or None when the result stands"""
+    if stage['predicted_class'] is None or stage['confidence'] >= CASCADE_CONFIDENCE_THRESHOLD:
+        return None
+    crop = stage['predicted_class'].split(' - ')[0]
+    model_name = CASCADE_SPECIALISTS.get(crop)
+    if model_name not in CLASS_NAMES or model_name == stage['model']:
+        return None
+    # A specialist that cannot express the predicted condition would only replace it with its own guess
+    if not _covers(model_name, stage['predicted_class']):
+        return None
+    # A specialist that is not deployed leaves the general result in place
+    return model_name if os.path.exists(get_model_path(model_name)) else None
+
+
+def cascade_batch(batch: np.ndarray, predict: Callable[[str, np.ndarray], np.ndarray]) -> List[List[Dict]]:
+    """Run the cascade over a stacked batch and return the stages of every image
+
+    ``predict(model_name, batch)`` returns class probabilities; the first model
+    sees the whole batch and each specialist one sub-batch of the images routed
+    to it. A specialist answer without a label leaves the first-stage result
+    in place.
+    """
+    stages = [[stage_result(CASCADE_FIRST_MODEL, probabilities)]
+              for probabilities in predict(CASCADE_FIRST_MODEL, batch)]
+
+    routed = defaultdict(list)
+    for row, image_stages in enumerate(stages):
+        model_name = specialist_for(image_stages[0])
+        if model_name is not None:
+            routed[model_name].append(row)
+
+    for model_name, rows in routed.items():
+        for row, probabilities in zip(rows, predict(model_name, batch[rows])):
+            specialist_stage = stage_result(model_name, probabilities)
+            if specialist_stage['predicted_class'] is not None:
+                stages[row].append(specialist_stage)
+    return stages
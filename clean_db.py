@@ -1,80 +1,414 @@
 #!/usr/bin/env python3
 """
-Database cleanup script to fix confidence data type issues
+Database maintenance tool: repairs, retention, blob garbage collection,
+vacuum, ANALYZE, integrity checks and size reports.
+
+Every command works in short chunked transactions so it can run while the
+application is serving.
 """
 
-import sqlite3
+import argparse
 import os
 import sys
+import time
+from datetime import datetime, timedelta
+
+from config import DATABASE_PATH
+
+# Blobs stored (or stored again) and blob files written more recently than this
+# are never collected: the application writes a blob before the row referencing it
+GC_GRACE_SECONDS = 3600
 
-def clean_database():
-    """Clean up the database and fix data type issues"""
-    
-    db_path = "predictions.db"
-    
-    if not os.path.exists(db_path):
+# Blob references of a prediction that retention strips
+IMAGE_COLUMNS = ("image_blob", "heatmap_blob", "thumb_blob")
+IMAGES_PRESENT = " OR ".join(f"{column} IS NOT NULL" for column in IMAGE_COLUMNS)
+STRIP_IMAGES = ", ".join(f"{column} = NULL" for column in IMAGE_COLUMNS)
+
+
+def open_database():
+    """Return the application's database, or None when it does not exist yet"""
+    if not os.path.exists(DATABASE_PATH):
         print("Database does not exist yet.")
+        return None
+
+    # Imported here so opening the database (and migrating it) only happens when asked
+    from database import db
+    return db
+
+
+def progress(label, done, total):
+    """Print a single, overwritten progress line"""
+    percent = 100.0 * done / total if total else 100.0
+    end = "\n" if done >= total else ""
+    print(f"\r{label}: {done}/{total} ({percent:.0f}%)", end=end, flush=True)
+
+
+def format_size(size):
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.1f} {unit}" if unit != "B" else f"{size} B"
+        size /= 1024
+
+
+def id_ranges(db, chunk_size):
+    """Split the predictions id space into (first, last) ranges of chunk_size ids"""
+    with db.pool.connection() as conn:
+        first, last = conn.execute("SELECT MIN(id), MAX(id) FROM predictions").fetchone()
+    if first is None:
+        return []
+    return [(start, min(start + chunk_size - 1, last)) for start in range(first, last + 1, chunk_size)]
+
+
+def repair(db, args):
+    """Fix confidence types and dangling blob references, one id range at a time"""
+    ranges = id_ranges(db, args.chunk_size)
+    fixed_confidence = 0
+    cleared_refs = 0
+
+    for done, (first, last) in enumerate(ranges, 1):
+        fixed_confidence += db.fix_existing_data(first, last)
+
+        # References to blobs that were never registered cannot be served
+        with db.pool.connection() as conn:
+            for table, column in db.BLOB_REFERENCES:
+                if table != "predictions":
+                    continue
+                cursor = conn.execute(f'''
+                    UPDATE predictions SET {column} = NULL
+                    WHERE id BETWEEN ? AND ? AND {column} IS NOT NULL
+                      AND NOT EXISTS (SELECT 1 FROM blobs WHERE digest = predictions.{column})
+                ''', (first, last))
+                cleared_refs += cursor.rowcount
+            conn.commit()
+
+        progress("Repairing predictions", done, len(ranges))
+
+    print(f"Fixed {fixed_confidence} confidence values")
+    print(f"Cleared {cleared_refs} dangling blob references")
+    return True
+
+
+def rebuild_stats(db, args):
+    """Recompute the statistics rollups from the predictions table"""
+    print("Rebuilding statistics rollups...")
+    db.rebuild_statistics()
+    stats = db.get_prediction_statistics()
+    print(f"✅ Rollups rebuilt from {stats['total_predictions']} predictions")
+    return True
+
+
+def _chunked(db, label, select_sql, apply_sql, params, chunk_size, dry_run):
+    """Apply a statement to the ids returned by a query, chunk by chunk, returning the row count"""
+    with db.pool.connection() as conn:
+        total = conn.execute(f"SELECT COUNT(*) FROM ({select_sql})", params).fetchone()[0]
+    if dry_run or total == 0:
+        print(f"{label}: {total} rows{' (dry run)' if dry_run else ''}")
+        return total
+
+    done = 0
+    while done < total:
+        with db.pool.connection() as conn:
+            ids = [row[0] for row in conn.execute(f"{select_sql} LIMIT ?", params + [chunk_size])]
+            if not ids:
+                break
+            placeholders = ",".join("?" * len(ids))
+            conn.execute(apply_sql.format(ids=placeholders), ids)
+            conn.commit()
+        done += len(ids)
+        progress(label, min(done, total), total)
+    return done
+
+
+def retention(db, args):
+    """Delete old predictions or strip their images, and keep stored images within a size budget"""
+    if args.older_than is None and args.max_image_mb is None:
+        print("Nothing to do: pass --older-than and/or --max-image-mb")
+        return False
+
+    if args.older_than is not None:
+        cutoff = datetime.now() - timedelta(days=args.older_than)
+        if args.strip_images:
+            _chunked(db, f"Stripping images older than {args.older_than} days",
+                     "SELECT id FROM predictions WHERE timestamp < ? "
+                     f"AND ({IMAGES_PRESENT}) ORDER BY timestamp, id",
+                     f"UPDATE predictions SET {STRIP_IMAGES} WHERE id IN ({{ids}})",
+                     [cutoff], args.chunk_size, args.dry_run)
+        else:
+            _chunked(db, f"Deleting predictions older than {args.older_than} days",
+                     "SELECT id FROM predictions WHERE timestamp < ? ORDER BY timestamp, id",
+                     "DELETE FROM predictions WHERE id IN ({ids})",
+                     [cutoff], args.chunk_size, args.dry_run)
+
+    if args.max_image_mb is not None:
+        strip_over_budget(db, int(args.max_image_mb * 1024 * 1024), args)
+
+    if not args.dry_run:
+        gc_blobs(db, args)
+    return True
+
+
+def strip_over_budget(db, budget, args):
+    """Strip images from the oldest predictions until the referenced images fit the budget"""
+    # Reference count and size of every blob predictions point at; a blob
+    # only frees space once the last prediction referencing it is stripped
+    references = " UNION ALL ".join(f"SELECT {column} AS digest FROM predictions" for column in IMAGE_COLUMNS)
+    with db.pool.connection() as conn:
+        blobs = {digest: [count, size] for digest, count, size in conn.execute(f'''
+            SELECT r.digest, COUNT(*), b.size FROM ({references}) r JOIN blobs b ON b.digest = r.digest
+            GROUP BY r.digest
+        ''')}
+    used = sum(size for _, size in blobs.values())
+    excess = used - budget
+    print(f"Stored images: {format_size(used)} of {format_size(budget)} budget")
+    if excess <= 0:
         return
-    
-    print("Cleaning database...")
-    
-    try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        
-        # Check the current schema
-        cursor.execute("PRAGMA table_info(predictions)")
-        columns = cursor.fetchall()
-        print("Current table schema:")
-        for col in columns:
-            print(f"  {col}")
-        
-        # Get all predictions with their confidence values
-        cursor.execute("SELECT id, confidence FROM predictions")
-        predictions = cursor.fetchall()
-        
-        print(f"Found {len(predictions)} predictions to check...")
-        
-        fixed_count = 0
-        for pred_id, confidence in predictions:
-            # Check if confidence is not a proper number
-            if confidence is None:
-                cursor.execute("UPDATE predictions SET confidence = ? WHERE id = ?", (0.0, pred_id))
-                fixed_count += 1
-            else:
-                try:
-                    # Try to convert to float
-                    float_confidence = float(confidence)
-                    # Update with proper float value
-                    cursor.execute("UPDATE predictions SET confidence = ? WHERE id = ?", (float_confidence, pred_id))
-                except (ValueError, TypeError) as e:
-                    print(f"Fixing prediction {pred_id} with invalid confidence: {confidence}")
-                    cursor.execute("UPDATE predictions SET confidence = ? WHERE id = ?", (0.0, pred_id))
-                    fixed_count += 1
-        
+
+    # Walk the oldest rows with images until the blobs they release cover the excess
+    freed = 0
+    stripped = 0
+    after = ("", 0)
+    while freed < excess:
+        with db.pool.connection() as conn:
+            rows = conn.execute(f'''
+                SELECT id, timestamp, {", ".join(IMAGE_COLUMNS)}
+                FROM predictions
+                WHERE ({IMAGES_PRESENT}) AND (timestamp, id) > (?, ?)
+                ORDER BY timestamp, id
+                LIMIT ?
+            ''', (*after, args.chunk_size)).fetchall()
+            if not rows:
+                break
+
+            ids = []
+            for pred_id, timestamp, *digests in rows:
+                if freed >= excess:
+                    break
+                ids.append(pred_id)
+                after = (timestamp, pred_id)
+                for digest in digests:
+                    entry = blobs.get(digest)
+                    if entry is None:
+                        continue
+                    entry[0] -= 1
+                    if entry[0] == 0:
+                        freed += entry[1]
+
+            if not args.dry_run:
+                conn.execute(f"UPDATE predictions SET {STRIP_IMAGES} "
+                             f"WHERE id IN ({','.join('?' * len(ids))})", ids)
+                conn.commit()
+        stripped += len(ids)
+        progress("Freeing image budget", min(freed, excess), excess)
+
+    print(f"{'Would strip' if args.dry_run else 'Stripped'} images of {stripped} predictions "
+          f"(~{format_size(freed)})")
+
+
+def gc_blobs(db, args):
+    """Delete blobs no longer referenced by any prediction or cached result, and stray blob files"""
+    grace_cutoff = datetime.now() - timedelta(seconds=GC_GRACE_SECONDS)
+    references = " UNION ".join(f"SELECT {column} FROM {table} WHERE {column} IS NOT NULL"
+                                for table, column in db.BLOB_REFERENCES)
+
+    with db.pool.connection() as conn:
+        # One pass over the referencing tables instead of a lookup per blob
+        conn.execute("DROP TABLE IF EXISTS temp.live_blobs")
+        conn.execute("CREATE TEMP TABLE live_blobs (digest TEXT PRIMARY KEY) WITHOUT ROWID")
+        conn.execute(f"INSERT OR IGNORE INTO temp.live_blobs {references}")
+        garbage = conn.execute('''
+            SELECT digest, size FROM blobs
+            WHERE COALESCE(last_seen, created_at) < ? AND digest NOT IN (SELECT digest FROM temp.live_blobs)
+        ''', (grace_cutoff,)).fetchall()
+        conn.execute("DROP TABLE temp.live_blobs")
+
+    freed = sum(size for _, size in garbage)
+    print(f"Unreferenced blobs: {len(garbage)} ({format_size(freed)}){' (dry run)' if args.dry_run else ''}")
+    if not args.dry_run:
+        for start in range(0, len(garbage), args.chunk_size):
+            chunk = [digest for digest, _ in garbage[start:start + args.chunk_size]]
+            placeholders = ','.join('?' * len(chunk))
+            with db.pool.connection() as conn:
+                # Blobs stored again since the scan started are kept
+                conn.execute(f"DELETE FROM blobs WHERE digest IN ({placeholders}) "
+                             f"AND COALESCE(last_seen, created_at) < ?", chunk + [grace_cutoff])
+                conn.commit()
+                kept = {row[0] for row in conn.execute(
+                    f"SELECT digest FROM blobs WHERE digest IN ({placeholders})", chunk)}
+            for digest in chunk:
+                if digest not in kept:
+                    db.blob_store.delete(digest)
+            progress("Deleting blobs", min(start + len(chunk), len(garbage)), len(garbage))
+
+    # Files that no blobs row describes: interrupted writes and leftovers of deleted rows
+    stray = []
+    for root, _, files in os.walk(db.blob_store.root):
+        candidates = [name for name in files
+                      if os.path.getmtime(os.path.join(root, name)) < time.time() - GC_GRACE_SECONDS]
+        for start in range(0, len(candidates), 500):
+            chunk = candidates[start:start + 500]
+            with db.pool.connection() as conn:
+                known = {row[0] for row in conn.execute(
+                    f"SELECT digest FROM blobs WHERE digest IN ({','.join('?' * len(chunk))})", chunk)}
+            stray.extend(os.path.join(root, name) for name in chunk if name not in known)
+    print(f"Stray blob files: {len(stray)}{' (dry run)' if args.dry_run else ''}")
+    if not args.dry_run:
+        for path in stray:
+            os.remove(path)
+    return True
+
+
+def vacuum(db, args):
+    """Return free pages to the file system without rewriting the whole database"""
+    with db.pool.connection() as conn:
+        mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+        if mode != 2:
+            if not args.full:
+                print("⚠️  Incremental vacuum is not enabled for this database; "
+                      "run 'vacuum --full' once (it rewrites the file and blocks writers)")
+                return False
+            print("Switching to incremental auto-vacuum and rebuilding the database...")
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("VACUUM")
+
+        free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        done = 0
+        while done < free_pages:
+            step = min(args.pages, free_pages - done)
+            conn.execute(f"PRAGMA incremental_vacuum({step})").fetchall()
+            done += step
+            progress("Reclaiming free pages", done, free_pages)
+
+        # Fold the WAL back into the main file and shrink it
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+
+    print(f"✅ Reclaimed {free_pages} free pages")
+    return True
+
+
+def analyze(db, args):
+    """Refresh the query planner statistics"""
+    with db.pool.connection() as conn:
+        conn.execute("ANALYZE")
+        conn.execute("PRAGMA optimize")
         conn.commit()
-        print(f"Fixed {fixed_count} confidence values")
-        
-        # Verify the fix
-        cursor.execute("SELECT COUNT(*) FROM predictions WHERE confidence IS NULL OR confidence = ''")
-        null_count = cursor.fetchone()[0]
-        
-        if null_count == 0:
-            print("✅ All confidence values are now properly formatted")
-        else:
-            print(f"⚠️  Still have {null_count} null/empty confidence values")
-        
-        conn.close()
-        
-    except Exception as e:
-        print(f"Error cleaning database: {e}")
-        return False
-    
+    print("✅ Query planner statistics updated")
     return True
 
+
+def check(db, args):
+    """Run SQLite's integrity (or quick) check"""
+    pragma = "quick_check" if args.quick else "integrity_check"
+    with db.pool.connection() as conn:
+        problems = [row[0] for row in conn.execute(f"PRAGMA {pragma}")]
+
+    if problems == ["ok"]:
+        print(f"✅ {pragma}: ok")
+        return True
+    print(f"⚠️  {pragma} reported {len(problems)} problems:")
+    for problem in problems[:50]:
+        print(f"  {problem}")
+    return False
+
+
+def report(db, args):
+    """Print database, table and blob store sizes"""
+    with db.pool.connection() as conn:
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        print(f"Database: {format_size(page_size * page_count)} "
+              f"({format_size(page_size * free_pages)} free, schema version {db.get_schema_version()})")
+        pending = db.get_pending_migrations()
+        if pending:
+            print(f"Pending migrations: {', '.join(map(str, pending))} (retried when the application starts)")
+
+        tables = [row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name")]
+        try:
+            sizes = dict(conn.execute("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name").fetchall())
+        except Exception:
+            # SQLite built without the dbstat table
+            sizes = {}
+
+        print("Tables:")
+        for table in tables:
+            rows = conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0]
+            size = f", {format_size(sizes[table])}" if table in sizes else ""
+            print(f"  {table}: {rows} rows{size}")
+
+        count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+        by_type = conn.execute(
+            "SELECT content_type, COUNT(*), SUM(size) FROM blobs GROUP BY content_type ORDER BY 3 DESC").fetchall()
+
+    print(f"Blobs: {count} ({format_size(total)})")
+    for content_type, type_count, type_size in by_type:
+        print(f"  {content_type}: {type_count} ({format_size(type_size)})")
+    return True
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Prediction database maintenance")
+    parser.add_argument("--chunk-size", type=int, default=1000,
+                        help="rows changed per transaction (default: 1000)")
+    commands = parser.add_subparsers(dest="command")
+
+    commands.add_parser("repair", help="fix confidence types and dangling blob references (default)")
+    commands.add_parser("rebuild-stats", help="recompute the statistics rollups")
+
+    retention_parser = commands.add_parser("retention", help="apply a retention policy")
+    retention_parser.add_argument("--older-than", type=int, metavar="DAYS",
+                                  help="act on predictions older than DAYS days")
+    retention_parser.add_argument("--strip-images", action="store_true",
+                                  help="drop the stored images of old predictions instead of deleting them")
+    retention_parser.add_argument("--max-image-mb", type=float, metavar="MB",
+                                  help="strip images of the oldest predictions beyond this total size")
+    retention_parser.add_argument("--dry-run", action="store_true", help="only report what would change")
+
+    gc_parser = commands.add_parser("gc-blobs", help="delete unreferenced blobs")
+    gc_parser.add_argument("--dry-run", action="store_true", help="only report what would be deleted")
+
+    vacuum_parser = commands.add_parser("vacuum", help="reclaim free pages incrementally")
+    vacuum_parser.add_argument("--pages", type=int, default=1000, help="pages freed per step (default: 1000)")
+    vacuum_parser.add_argument("--full", action="store_true",
+                               help="enable incremental vacuum with one full VACUUM if needed")
+
+    commands.add_parser("analyze", help="update query planner statistics")
+    check_parser = commands.add_parser("check", help="run an integrity check")
+    check_parser.add_argument("--quick", action="store_true", help="run the faster quick_check")
+    commands.add_parser("report", help="show table and blob sizes")
+    return parser
+
+
+COMMANDS = {
+    "repair": repair,
+    "rebuild-stats": rebuild_stats,
+    "retention": retention,
+    "gc-blobs": gc_blobs,
+    "vacuum": vacuum,
+    "analyze": analyze,
+    "check": check,
+    "report": report,
+}
+
 if __name__ == "__main__":
-    if clean_database():
-        print("Database cleanup completed successfully!")
+    args = build_parser().parse_args()
+    command = args.command or "repair"
+
+    db = open_database()
+    if db is None:
+        sys.exit(1)
+
+    started = time.perf_counter()
+    try:
+        ok = COMMANDS[command](db, args)
+    except Exception as e:
+        print(f"Error running {command}: {e}")
+        ok = False
+    finally:
+        db.pool.close_all()
+
+    if ok:
+        print(f"Database {command} completed in {time.perf_counter() - started:.1f}s")
     else:
-        print("Database cleanup failed!")
+        print(f"Database {command} failed!")
         sys.exit(1)
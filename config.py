@@ -68,3 +68,91 @@ CLASS_NAMES = {
     ],
     # Add more models and their class names as needed
 }
+
+# Model registry settings
+MODEL_MEMORY_BUDGET_MB = 2048  # Upper bound for the weights of all models kept in memory
+MODEL_IDLE_TIMEOUT = 3600  # Seconds a model may stay unused before being evicted (None disables)
+PRELOAD_MODELS = list(CLASS_NAMES.keys())  # Models loaded and warmed up when the app starts
+WARMUP_IN_BACKGROUND = True  # Warm up after the app starts serving instead of delaying startup
+
+# Inference backend settings: "keras" runs models/<name>.keras, "tflite-float16" and
+# "tflite-int8" run models/<name>.<variant>.tflite built by convert_models.py
+INFERENCE_BACKENDS = {}  # Backend per model name, e.g. {"FAVDD": "tflite-int8"}
+DEFAULT_INFERENCE_BACKEND = "keras"  # Backend of models missing from INFERENCE_BACKENDS
+TFLITE_VARIANTS = ("float16", "int8")  # Quantized variants produced by the converter
+TFLITE_NUM_THREADS = 2  # CPU threads of each TFLite interpreter
+TFLITE_BATCH_SIZES = (1, 8, 32)  # Batch sizes TFLite inputs are padded up to; the interpreter resizes between them
+
+# Model cascade behind the "auto" model choice
+AUTO_MODEL = "auto"  # Model name clients send to let the cascade pick the model
+CASCADE_FIRST_MODEL = "FAVDD"  # General model every image goes through first
+CASCADE_CONFIDENCE_THRESHOLD = 90.0  # First-stage confidence (%) below which a specialist is consulted
+CASCADE_SPECIALISTS = {  # Crop predicted by the first model -> specialist model for that crop
+    "Apple": "Apple",
+    "Orange": "Citrus",
+    "Tomato": "Tomato",
+}
+
+# Batch prediction settings
+BATCH_MAX_IMAGES = 256  # Maximum number of images accepted by one batch request
+DECODE_WORKERS = 4  # Threads used to decode uploaded images in parallel
+
+# Micro-batching settings for concurrent single-image requests
+INFERENCE_MAX_BATCH_SIZE = 32  # Largest batch the scheduler runs in one model call
+INFERENCE_MAX_WAIT_MS = 5  # How long the first queued request waits for others to join its batch
+INFERENCE_MAX_QUEUE = 256  # Queued requests per model before answering 503
+
+# Grad-CAM explanation modes: "eager" renders the heatmap before responding, "lazy"
+# renders it in the background after responding, "none" only when it is first requested
+EXPLAIN_MODES = ("none", "lazy", "eager")
+DEFAULT_EXPLAIN_MODE = "eager"  # Mode of the upload form
+BATCH_DEFAULT_EXPLAIN_MODE = "none"  # Mode of the batch API
+
+# Execution pools keeping blocking work off the asyncio event loop
+CPU_WORKERS = 4  # Threads for decoding, inference and image encoding
+CPU_MAX_PENDING = 64  # Queued CPU tasks beyond the busy workers before answering 503
+DB_WORKERS = 2  # Threads dedicated to SQLite access
+DB_MAX_PENDING = 256  # Queued database tasks beyond the busy workers before answering 503
+
+# Prediction result cache keyed by (image SHA-256, model name, model version)
+RESULT_CACHE_SIZE = 1024  # Entries kept in the in-memory LRU tier
+RESULT_CACHE_PERSISTENT = True  # Also keep results in the SQLite prediction_cache table
+
+# Content-addressed blob store for uploaded images and heatmaps
+BLOB_STORE_BACKEND = "files"  # "files" keeps blobs under BLOB_STORE_DIR, "sqlite" in the database itself
+BLOB_STORE_DIR = "blobs"
+
+# Grad-CAM heatmap encoding
+HEATMAP_FORMAT = "PNG"  # "PNG" (lossless), "JPEG" (fastest and smallest) or "WEBP"
+HEATMAP_PNG_COMPRESSION = 1  # zlib level 0-9 of PNG heatmaps; higher levels are slower for a few % less
+HEATMAP_QUALITY = 85  # Quality 1-100 of JPEG and WebP heatmaps
+
+# Thumbnails and HTTP caching of stored images
+THUMBNAIL_SIZE = (256, 256)  # Bounding box of the history thumbnails (aspect ratio is kept)
+THUMBNAIL_FORMAT = "WEBP"  # Pillow format of the thumbnails
+THUMBNAIL_QUALITY = 75  # Lossy quality of the thumbnails
+IMAGE_CACHE_MAX_AGE = 86400  # Seconds browsers and proxies may reuse per-prediction images
+
+# SQLite connection pool settings
+DATABASE_PATH = "predictions.db"  # Prediction database file of the application
+DB_POOL_SIZE = 8  # Long-lived connections shared by all threads
+DB_BUSY_TIMEOUT_MS = 5000  # How long a connection waits for a lock before failing
+DB_CACHE_SIZE_KB = 65536  # Page cache per connection (PRAGMA cache_size)
+DB_MMAP_SIZE = 268435456  # Bytes of the database file memory-mapped (PRAGMA mmap_size)
+DB_STATEMENT_CACHE_SIZE = 256  # Prepared statements cached per connection
+
+# Write-behind persistence of prediction records
+WRITE_BEHIND_ENABLED = False  # Queue predictions and insert them from a background writer
+WRITE_BEHIND_MAX_BATCH = 500  # Records written per transaction at most
+WRITE_BEHIND_FLUSH_MS = 200  # Longest time a queued record waits before being flushed
+
+# History export settings
+EXPORT_CHUNK_SIZE = 5000  # Rows fetched from the database and encoded per chunk
+
+# Disease guide search settings
+DISEASE_SEARCH_CACHE_SIZE = 128  # Distinct search queries whose results are kept in memory
+
+# Metrics settings
+METRICS_ENABLED = True  # Time stages, requests and queries and serve them at /metrics
+METRICS_PREFIX = "favdd_"  # Prefix of every exported metric name
+METRICS_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # Seconds
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+TFLite conversion tool: builds float16 and int8 variants of the Keras models
+and reports their latency, size and top-1 agreement with the Keras originals.
+
+    python convert_models.py convert --calibration-dir samples/
+    python convert_models.py report --images samples/ --json report.json
+
+Select a converted variant per model with INFERENCE_BACKENDS in config.py.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+from backends import KerasBackend, TFLiteBackend
+from config import CLASS_NAMES, TFLITE_VARIANTS
+from preprocessing import preprocess_image
+from utils import get_model_path, get_tflite_path, load_selected_model, tf
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.webp')
+
+
+def load_images(directory, limit, seed=0):
+    """Preprocess up to ``limit`` images found under a directory (sampled reproducibly)"""
+    paths = sorted(
+        os.path.join(root, name)
+        for root, _, names in os.walk(directory)
+        for name in names
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+    random.Random(seed).shuffle(paths)
+
+    images = []
+    for path in paths:
+        if len(images) >= limit:
+            break
+        try:
+            with open(path, 'rb') as f:
+                images.append(preprocess_image(f.read()))
+        except Exception as e:
+            print(f"Skipping {path}: {e}")
+    return np.stack(images) if images else None
+
+
+def convert_model(model, variant, calibration=None):
+    """Return the TFLite flatbuffer of a Keras model for one variant"""
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if variant == "float16":
+        converter.target_spec.supported_types = [tf.float16]
+    elif variant == "int8":
+        # Activation ranges come from real images; input and output stay float32
+        def representative_dataset():
+            for image in calibration:
+                yield [image[np.newaxis]]
+        converter.representative_dataset = representative_dataset
+    else:
+        raise ValueError(f"Unknown variant '{variant}'")
+    return converter.convert()
+
+
+def selected_models(args):
+    models = args.models or list(CLASS_NAMES.keys())
+    unknown = [name for name in models if name not in CLASS_NAMES]
+    if unknown:
+        raise ValueError(f"Unknown models: {', '.join(unknown)}")
+    available = []
+    for name in models:
+        if os.path.exists(get_model_path(name)):
+            available.append(name)
+        else:
+            print(f"Skipping {name}: no model file")
+    return available
+
+
+def convert(args):
+    calibration = None
+    if "int8" in args.variants:
+        if not args.calibration_dir:
+            print("The int8 variant needs --calibration-dir with sample images")
+            return False
+        calibration = load_images(args.calibration_dir, args.calibration_samples)
+        if calibration is None:
+            print(f"No images found in {args.calibration_dir}")
+            return False
+        print(f"Calibrating int8 models on {len(calibration)} images")
+
+    for model_name in selected_models(args):
+        model = load_selected_model(model_name)
+        for variant in args.variants:
+            started = time.perf_counter()
+            data = convert_model(model, variant, calibration)
+            path = get_tflite_path(model_name, variant)
+            with open(path + '.tmp', 'wb') as f:
+                f.write(data)
+            os.replace(path + '.tmp', path)
+            print(f"✅ {model_name} {variant}: {path} ({len(data) / 1024 / 1024:.2f} MB, "
+                  f"{time.perf_counter() - started:.1f}s)")
+    return True
+
+
+def measure(backend, images, batch_size, runs):
+    """Predictions over every image, plus per-call latencies in milliseconds"""
+    backend.predict(images[:batch_size])  # Warm up (and size the interpreter)
+    predictions = np.concatenate([backend.predict(images[i:i + batch_size])
+                                  for i in range(0, len(images), batch_size)])
+
+    latencies = []
+    for run in range(runs):
+        start = (run * batch_size) % len(images)
+        batch = images[start:start + batch_size]
+        started = time.perf_counter()
+        backend.predict(batch)
+        latencies.append((time.perf_counter() - started) * 1000)
+    return predictions, np.array(latencies)
+
+
+def report(args):
+    images = load_images(args.images, args.samples)
+    if images is None:
+        print(f"No images found in {args.images}")
+        return False
+
+    rows = []
+    for model_name in selected_models(args):
+        keras_path = get_model_path(model_name)
+        backends = [KerasBackend(load_selected_model(model_name), keras_path)]
+        for variant in args.variants:
+            path = get_tflite_path(model_name, variant)
+            if os.path.exists(path):
+                backends.append(TFLiteBackend(path, variant))
+            else:
+                print(f"Skipping {model_name} {variant}: not converted")
+
+        reference = None
+        for backend in backends:
+            predictions, latencies = measure(backend, images, args.batch_size, args.runs)
+            if reference is None:
+                reference = predictions
+            rows.append({
+                'model': model_name,
+                'backend': backend.name,
+                'size_mb': round(backend.size_bytes / 1024 / 1024, 3),
+                'memory_mb': round(backend.memory_bytes / 1024 / 1024, 3),
+                'latency_p50_ms': round(float(np.percentile(latencies, 50)), 3),
+                'latency_p95_ms': round(float(np.percentile(latencies, 95)), 3),
+                'images_per_second': round(args.batch_size * 1000 / float(np.mean(latencies)), 1),
+                'top1_agreement': round(float(np.mean(predictions.argmax(1) == reference.argmax(1))), 4),
+                'max_abs_diff': round(float(np.max(np.abs(predictions - reference))), 4),
+            })
+
+    print(f"{len(images)} images, batch size {args.batch_size}, {args.runs} timed calls")
+    print(f"{'model':<10} {'backend':<16} {'size MB':>8} {'mem MB':>8} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'img/s':>8} {'top-1':>7} {'max diff':>9}")
+    for row in rows:
+        print(f"{row['model']:<10} {row['backend']:<16} {row['size_mb']:>8.2f} {row['memory_mb']:>8.2f} "
+              f"{row['latency_p50_ms']:>8.2f} {row['latency_p95_ms']:>8.2f} {row['images_per_second']:>8.1f} "
+              f"{row['top1_agreement']:>7.2%} {row['max_abs_diff']:>9.4f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'images': len(images), 'batch_size': args.batch_size, 'runs': args.runs,
+                       'results': rows}, f, indent=2)
+        print(f"Report written to {args.json}")
+    return True
+
+
+def build_parser():
+    # Model and variant selection shared by every command
+    selection = argparse.ArgumentParser(add_help=False)
+    selection.add_argument("--models", nargs="+", metavar="NAME", help="models to process (default: all)")
+    selection.add_argument("--variants", nargs="+", choices=TFLITE_VARIANTS, default=list(TFLITE_VARIANTS),
+                           help="variants to process (default: all)")
+
+    parser = argparse.ArgumentParser(description="TFLite model conversion and comparison")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    convert_parser = commands.add_parser("convert", parents=[selection], help="write models/<name>.<variant>.tflite")
+    convert_parser.add_argument("--calibration-dir", help="sample images calibrating the int8 variant")
+    convert_parser.add_argument("--calibration-samples", type=int, default=200,
+                                help="calibration images used at most (default: 200)")
+
+    report_parser = commands.add_parser("report", parents=[selection],
+                                        help="compare converted variants with the Keras models")
+    report_parser.add_argument("--images", required=True, help="directory of evaluation images")
+    report_parser.add_argument("--samples", type=int, default=500, help="images used at most (default: 500)")
+    report_parser.add_argument("--batch-size", type=int, default=1, help="images per timed call (default: 1)")
+    report_parser.add_argument("--runs", type=int, default=100, help="timed calls per backend (default: 100)")
+    report_parser.add_argument("--json", metavar="PATH", help="also write the report as JSON")
+    return parser
+
+
+COMMANDS = {
+    "convert": convert,
+    "report": report,
+}
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    try:
+        ok = COMMANDS[args.command](args)
+    except Exception as e:
+        print(f"Error running {args.command}: {e}")
+        ok = False
+
+    if not ok:
+        sys.exit(1)
@@ -1,125 +1,779 @@
 import sqlite3
 import json
+import logging
+import queue
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Tuple
 import os
 
+from blob_store import create_blob_store, parse_data_url
+from config import (
+    BLOB_STORE_BACKEND,
+    BLOB_STORE_DIR,
+    DATABASE_PATH,
+    DB_BUSY_TIMEOUT_MS,
+    DB_CACHE_SIZE_KB,
+    DB_MMAP_SIZE,
+    DB_POOL_SIZE,
+    DB_STATEMENT_CACHE_SIZE,
+    DISEASE_SEARCH_CACHE_SIZE,
+    EXPORT_CHUNK_SIZE
+)
+from metrics import timed_query
+
+logger = logging.getLogger(__name__)
+
+# Rows moved per transaction when migrating inline images to the blob store
+MIGRATION_CHUNK_SIZE = 200
+
+# Markers around matched terms in disease search highlights and snippets
+HIGHLIGHT_START = '\x02'
+HIGHLIGHT_END = '\x03'
+
+class ConnectionPool:
+    """Thread-safe pool of long-lived SQLite connections
+    
+    Connections are opened lazily up to ``size``, configured once for WAL
+    journaling so readers never block on the writer, and keep their prepared
+    statement cache across requests.
+    """
+    
+    def __init__(self, db_path: str, size: int = DB_POOL_SIZE):
+        self.db_path = db_path
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+    
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=DB_BUSY_TIMEOUT_MS / 1000,
+                               check_same_thread=False, cached_statements=DB_STATEMENT_CACHE_SIZE)
+        # Lets maintenance reclaim free pages incrementally; only takes effect on a new database
+        conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA cache_size=-{int(DB_CACHE_SIZE_KB)}')
+        conn.execute(f'PRAGMA mmap_size={int(DB_MMAP_SIZE)}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute(f'PRAGMA busy_timeout={int(DB_BUSY_TIMEOUT_MS)}')
+        return conn
+    
+    @contextmanager
+    def connection(self):
+        """Borrow a connection; uncommitted work is rolled back when it is returned"""
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_open = self._opened < self.size
+                if can_open:
+                    self._opened += 1
+            if can_open:
+                try:
+                    conn = self._open()
+                except BaseException:
+                    with self._lock:
+                        self._opened -= 1
+                    raise
+            else:
+                conn = self._idle.get()
+        
+        try:
+            yield conn
+        finally:
+            try:
+                if conn.in_transaction:
+                    conn.rollback()
+                conn.row_factory = None
+            except sqlite3.Error:
+                # Drop a broken connection so a fresh one is opened on demand
+                with self._lock:
+                    self._opened -= 1
+                conn.close()
+            else:
+                self._idle.put(conn)
+    
+    def close_all(self):
+        """Close every idle connection"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            with self._lock:
+                self._opened -= 1
+            conn.close()
+
+
 class PredictionDatabase:
-    def __init__(self, db_path: str = "predictions.db"):
+    # Versioned schema migrations: (version, description, method name), applied once each in order
+    MIGRATIONS = [
+        (1, "Move images and heatmaps to the external blob store", "_migrate_blob_store"),
+        (2, "Index predictions for history paging and filtering", "_migrate_history_indexes"),
+        (3, "Maintain statistics rollups with triggers", "_migrate_statistics_rollups"),
+        (4, "Full-text index over the disease guide", "_migrate_disease_search"),
+        (5, "Seed the disease guide", "_migrate_seed_disease_info"),
+        (6, "Store legacy text and blob confidence values as numbers", "_migrate_confidence_values"),
+        (7, "Reference prediction thumbnails", "_migrate_thumbnails"),
+        (8, "Record the stages of cascaded predictions", "_migrate_cascade_stages"),
+        (9, "Keep blob bytes in the database for the sqlite blob store", "_migrate_blob_data"),
+        (10, "Track when each blob was last stored", "_migrate_blob_last_seen"),
+    ]
+    
+    # Rollup tables kept in step with predictions: (table, key column, key expression over a row)
+    STATISTICS_ROLLUPS = [
+        ('stats_by_model', 'model_name', '{row}.model_name'),
+        ('stats_by_class', 'predicted_class', '{row}.predicted_class'),
+        ('stats_by_hour', 'hour', "strftime('%Y-%m-%d %H:00:00', {row}.timestamp)"),
+    ]
+    
+    # Columns referencing blob store digests: (table, column)
+    BLOB_REFERENCES = [
+        ('predictions', 'image_blob'),
+        ('predictions', 'heatmap_blob'),
+        ('predictions', 'thumb_blob'),
+        ('prediction_cache', 'heatmap_blob'),
+    ]
+    
+    # Text columns of disease_info indexed for search, with their bm25 weights
+    DISEASE_SEARCH_COLUMNS = [
+        ('disease_name', 10.0),
+        ('description', 2.0),
+        ('symptoms', 4.0),
+        ('causes', 2.0),
+        ('treatment', 1.0),
+        ('prevention', 1.0),
+        ('affected_plants', 5.0),
+    ]
+    
+    def __init__(self, db_path: str = DATABASE_PATH, blob_dir: str = BLOB_STORE_DIR,
+                 blob_backend: str = BLOB_STORE_BACKEND):
         self.db_path = db_path
+        self.pool = ConnectionPool(db_path)
+        self.blob_store = create_blob_store(blob_backend, blob_dir, self)
+        self._disease_search_cache: "OrderedDict[str, List[Dict]]" = OrderedDict()
+        self._disease_search_lock = threading.Lock()
         self.init_database()
     
     def init_database(self):
         """Initialize the database with required tables"""
-        conn = sqlite3.connect(self.db_path)
+        started = time.perf_counter()
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            
+            # Create predictions table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS predictions (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    timestamp DATETIME NOT NULL,
+                    model_name TEXT NOT NULL,
+                    predicted_class TEXT NOT NULL,
+                    confidence REAL NOT NULL,
+                    file_name TEXT NOT NULL,
+                    file_size INTEGER NOT NULL,
+                    file_type TEXT NOT NULL,
+                    image_data TEXT,
+                    heatmap_data TEXT
+                )
+            ''')
+            
+            # Create disease_info table for the disease guide
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS disease_info (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    disease_name TEXT NOT NULL UNIQUE,
+                    description TEXT NOT NULL,
+                    symptoms TEXT NOT NULL,
+                    causes TEXT NOT NULL,
+                    treatment TEXT NOT NULL,
+                    prevention TEXT NOT NULL,
+                    severity_level TEXT NOT NULL,
+                    affected_plants TEXT NOT NULL
+                )
+            ''')
+            
+            conn.commit()
+        
+        # Bring the schema up to date; data fixes run once as migrations
+        self.applied_migrations = self.run_migrations()
+        self.init_seconds = time.perf_counter() - started
+    
+    def run_migrations(self) -> List[int]:
+        """Apply pending schema migrations, record them in schema_version and return their versions"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    description TEXT NOT NULL,
+                    applied_at DATETIME NOT NULL
+                )
+            ''')
+            conn.commit()
+            
+            cursor.execute('SELECT version FROM schema_version')
+            applied = {row[0] for row in cursor.fetchall()}
+            
+            newly_applied = []
+            for version, description, method in self.MIGRATIONS:
+                if version in applied:
+                    continue
+                if getattr(self, method)(conn) is False:
+                    # Not applicable with this SQLite build (e.g. one without FTS5); it stays
+                    # pending, is reported as such and is retried on every start
+                    logger.warning("Migration %d (%s) skipped; it will be retried on the next start",
+                                   version, description)
+                    continue
+                cursor.execute('INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)',
+                               (version, description, datetime.now()))
+                conn.commit()
+                newly_applied.append(version)
+        
+        return newly_applied
+    
+    def get_schema_version(self) -> int:
+        """Get the highest migration version up to which every migration is applied
+        
+        A skipped migration holds the version back even when later ones are
+        applied; see get_pending_migrations for the full picture.
+        """
+        applied = self._applied_versions()
+        version = 0
+        for migration_version, _, _ in self.MIGRATIONS:
+            if migration_version not in applied:
+                break
+            version = migration_version
+        return version
+    
+    def get_pending_migrations(self) -> List[int]:
+        """Get the versions of migrations not applied yet, in order"""
+        applied = self._applied_versions()
+        return [version for version, _, _ in self.MIGRATIONS if version not in applied]
+    
+    def _applied_versions(self) -> set:
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT version FROM schema_version')
+            return {row[0] for row in cursor.fetchall()}
+    
+    @staticmethod
+    def _add_column(cursor, table: str, column: str, declaration: str):
+        cursor.execute(f'PRAGMA table_info({table})')
+        if column not in [row[1] for row in cursor.fetchall()]:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {declaration}')
+    
+    def _migrate_blob_store(self, conn):
+        """Add blob references and move inline base64 images out of the predictions table"""
         cursor = conn.cursor()
         
-        # Create predictions table
+        self._add_column(cursor, 'predictions', 'image_blob', 'TEXT')
+        self._add_column(cursor, 'predictions', 'heatmap_blob', 'TEXT')
+        
+        # Content type and size of every stored blob, keyed by its SHA-256
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS blobs (
+                digest TEXT PRIMARY KEY,
+                content_type TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at DATETIME NOT NULL
+            )
+        ''')
+        
+        # Cached results reference their heatmap by digest; the cache is disposable
+        cursor.execute('DROP TABLE IF EXISTS prediction_cache')
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS predictions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp DATETIME NOT NULL,
+            CREATE TABLE prediction_cache (
+                image_hash TEXT NOT NULL,
                 model_name TEXT NOT NULL,
+                model_version TEXT NOT NULL,
                 predicted_class TEXT NOT NULL,
                 confidence REAL NOT NULL,
-                file_name TEXT NOT NULL,
-                file_size INTEGER NOT NULL,
-                file_type TEXT NOT NULL,
-                image_data TEXT,
-                heatmap_data TEXT
+                heatmap_blob TEXT,
+                created_at DATETIME NOT NULL,
+                PRIMARY KEY (image_hash, model_name, model_version)
             )
         ''')
+        conn.commit()
+        
+        # Move existing data URLs to the blob store in chunks, committing as we go
+        while True:
+            cursor.execute('''
+                SELECT id, image_data, heatmap_data FROM predictions
+                WHERE image_data IS NOT NULL OR heatmap_data IS NOT NULL
+                LIMIT ?
+            ''', (MIGRATION_CHUNK_SIZE,))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            
+            for pred_id, image_data, heatmap_data in rows:
+                blob_refs = []
+                for data_url in (image_data, heatmap_data):
+                    digest = None
+                    if data_url:
+                        try:
+                            content_type, data = parse_data_url(data_url)
+                        except ValueError:
+                            data = None
+                        if data:
+                            digest = self.blob_store.write(data)
+                            cursor.execute('''
+                                INSERT OR IGNORE INTO blobs (digest, content_type, size, created_at)
+                                VALUES (?, ?, ?, ?)
+                            ''', (digest, content_type, len(data), datetime.now()))
+                    blob_refs.append(digest)
+                
+                cursor.execute('''
+                    UPDATE predictions
+                    SET image_blob = COALESCE(?, image_blob), heatmap_blob = COALESCE(?, heatmap_blob),
+                        image_data = NULL, heatmap_data = NULL
+                    WHERE id = ?
+                ''', (blob_refs[0], blob_refs[1], pred_id))
+            
+            conn.commit()
+    
+    def _migrate_history_indexes(self, conn):
+        """Add indexes serving keyset pagination and the history filters"""
+        cursor = conn.cursor()
+        
+        # Newest-first keyset pagination walks (timestamp, id)
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_predictions_timestamp ON predictions (timestamp, id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_predictions_model ON predictions (model_name, timestamp, id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_predictions_class ON predictions (predicted_class, timestamp, id)')
+        conn.commit()
+    
+    def _migrate_statistics_rollups(self, conn):
+        """Create the statistics rollup tables, the triggers maintaining them and backfill them"""
+        cursor = conn.cursor()
+        
+        for table, key, _ in self.STATISTICS_ROLLUPS:
+            cursor.execute(f'''
+                CREATE TABLE IF NOT EXISTS {table} (
+                    {key} TEXT PRIMARY KEY,
+                    prediction_count INTEGER NOT NULL,
+                    confidence_sum REAL NOT NULL
+                )
+            ''')
+        
+        # Triggers run inside the writing transaction, so rollups never drift from the rows
+        def add_statements(row):
+            return ''.join(f'''
+                INSERT INTO {table} ({key}, prediction_count, confidence_sum)
+                VALUES ({expr.format(row=row)}, 1, CAST({row}.confidence AS REAL))
+                ON CONFLICT({key}) DO UPDATE SET
+                    prediction_count = prediction_count + 1,
+                    confidence_sum = confidence_sum + excluded.confidence_sum;'''
+                for table, key, expr in self.STATISTICS_ROLLUPS)
+        
+        def remove_statements(row):
+            return ''.join(f'''
+                UPDATE {table}
+                SET prediction_count = prediction_count - 1,
+                    confidence_sum = confidence_sum - CAST({row}.confidence AS REAL)
+                WHERE {key} = {expr.format(row=row)};
+                DELETE FROM {table} WHERE {key} = {expr.format(row=row)} AND prediction_count <= 0;'''
+                for table, key, expr in self.STATISTICS_ROLLUPS)
+        
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_predictions_stats_insert AFTER INSERT ON predictions
+            BEGIN {add_statements('NEW')}
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_predictions_stats_delete AFTER DELETE ON predictions
+            BEGIN {remove_statements('OLD')}
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_predictions_stats_update
+            AFTER UPDATE OF timestamp, model_name, predicted_class, confidence ON predictions
+            BEGIN {remove_statements('OLD')}{add_statements('NEW')}
+            END
+        ''')
+        conn.commit()
+        
+        self._rebuild_statistics(cursor)
+        conn.commit()
+    
+    def _rebuild_statistics(self, cursor):
+        for table, key, expr in self.STATISTICS_ROLLUPS:
+            cursor.execute(f'DELETE FROM {table}')
+            cursor.execute(f'''
+                INSERT INTO {table} ({key}, prediction_count, confidence_sum)
+                SELECT {expr.format(row='predictions')}, COUNT(*), COALESCE(SUM(CAST(confidence AS REAL)), 0)
+                FROM predictions
+                GROUP BY 1
+            ''')
+    
+    def rebuild_statistics(self):
+        """Recompute every statistics rollup from the predictions table"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            self._rebuild_statistics(cursor)
+            conn.commit()
+    
+    def _migrate_disease_search(self, conn):
+        """Create the FTS5 mirror of disease_info and the triggers keeping it in sync"""
+        cursor = conn.cursor()
+        columns = ', '.join(name for name, _ in self.DISEASE_SEARCH_COLUMNS)
+        new_values = ', '.join(f'new.{name}' for name, _ in self.DISEASE_SEARCH_COLUMNS)
+        old_values = ', '.join(f'old.{name}' for name, _ in self.DISEASE_SEARCH_COLUMNS)
+        
+        try:
+            cursor.execute(f'''
+                CREATE VIRTUAL TABLE IF NOT EXISTS disease_info_fts USING fts5(
+                    {columns},
+                    content='disease_info', content_rowid='id',
+                    tokenize='porter unicode61 remove_diacritics 2', prefix='2 3'
+                )
+            ''')
+        except sqlite3.OperationalError:
+            logger.warning("SQLite has no FTS5 support; disease search falls back to LIKE")
+            return False
+        
+        # External-content table: mirror every change of disease_info
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_disease_info_fts_insert AFTER INSERT ON disease_info BEGIN
+                INSERT INTO disease_info_fts (rowid, {columns}) VALUES (new.id, {new_values});
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_disease_info_fts_delete AFTER DELETE ON disease_info BEGIN
+                INSERT INTO disease_info_fts (disease_info_fts, rowid, {columns}) VALUES ('delete', old.id, {old_values});
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_disease_info_fts_update AFTER UPDATE ON disease_info BEGIN
+                INSERT INTO disease_info_fts (disease_info_fts, rowid, {columns}) VALUES ('delete', old.id, {old_values});
+                INSERT INTO disease_info_fts (rowid, {columns}) VALUES (new.id, {new_values});
+            END
+        ''')
+        cursor.execute("INSERT INTO disease_info_fts (disease_info_fts) VALUES ('rebuild')")
+        conn.commit()
+    
+    def _migrate_seed_disease_info(self, conn):
+        """Fill the disease guide of a new database"""
+        # Migrations run on the connection they were given; borrowing another
+        # one would deadlock a pool of size one
+        self._populate_disease_info(conn)
+        self._invalidate_disease_search()
+    
+    def _migrate_confidence_values(self, conn):
+        """Convert confidence values stored as text or blobs by old versions"""
+        self._fix_confidence_values(conn)
+    
+    def _migrate_thumbnails(self, conn):
+        """Add the thumbnail reference; thumbnails of older rows are created on first request"""
+        self._add_column(conn.cursor(), 'predictions', 'thumb_blob', 'TEXT')
+        conn.commit()
+    
+    def _migrate_cascade_stages(self, conn):
+        """Add the JSON list of models an "auto" prediction went through"""
+        self._add_column(conn.cursor(), 'predictions', 'cascade_stages', 'TEXT')
+        conn.commit()
+    
+    def _migrate_blob_data(self, conn):
+        """Create the table holding blob bytes, cleaned up along with their blobs row"""
+        cursor = conn.cursor()
         
-        # Create disease_info table for the disease guide
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS disease_info (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                disease_name TEXT NOT NULL UNIQUE,
-                description TEXT NOT NULL,
-                symptoms TEXT NOT NULL,
-                causes TEXT NOT NULL,
-                treatment TEXT NOT NULL,
-                prevention TEXT NOT NULL,
-                severity_level TEXT NOT NULL,
-                affected_plants TEXT NOT NULL
+            CREATE TABLE IF NOT EXISTS blob_data (
+                digest TEXT PRIMARY KEY,
+                data BLOB NOT NULL
             )
         ''')
-        
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS blobs_delete_data AFTER DELETE ON blobs
+            BEGIN
+                DELETE FROM blob_data WHERE digest = old.digest;
+            END
+        ''')
         conn.commit()
-        conn.close()
+    
+    def _migrate_blob_last_seen(self, conn):
+        """Add the time a blob was last stored, which re-uploads of the same content refresh"""
+        cursor = conn.cursor()
+        self._add_column(cursor, 'blobs', 'last_seen', 'DATETIME')
+        cursor.execute('UPDATE blobs SET last_seen = created_at WHERE last_seen IS NULL')
+        conn.commit()
+    
+    def register_blob(self, digest: str, content_type: str, size: int):
+        """Record the content type and size of a stored blob, refreshing when it was last stored"""
+        self.register_blobs([(digest, content_type, size)])
+    
+    @timed_query
+    def register_blobs(self, blobs: List[Tuple[str, str, int]]):
+        """Record several (digest, content type, size) blobs in one transaction"""
+        now = datetime.now()
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.executemany('''
+                INSERT INTO blobs (digest, content_type, size, created_at, last_seen)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (digest) DO UPDATE SET last_seen = excluded.last_seen
+            ''', [(digest, content_type, size, now, now) for digest, content_type, size in blobs])
+            
+            conn.commit()
+    
+    @timed_query
+    def get_blob_info(self, digest: str) -> Optional[Dict]:
+        """Get the content type and size of a stored blob"""
+        with self.pool.connection() as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+            
+            cursor.execute('SELECT digest, content_type, size FROM blobs WHERE digest = ?', (digest,))
+            
+            result = cursor.fetchone()
         
-        # Populate disease info if empty
-        self.populate_disease_info()
+        return dict(result) if result else None
+    
+    def save_blob_data(self, digest: str, content_type: str, data: bytes):
+        """Record a blob and store its bytes in one transaction"""
+        self.save_blobs_data([(digest, content_type, data)])
+    
+    @timed_query
+    def save_blobs_data(self, blobs: List[Tuple[str, str, bytes]]):
+        """Record several (digest, content type, bytes) blobs and store their bytes in one transaction"""
+        now = datetime.now()
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.executemany('''
+                INSERT INTO blobs (digest, content_type, size, created_at, last_seen)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (digest) DO UPDATE SET last_seen = excluded.last_seen
+            ''', [(digest, content_type, len(data), now, now) for digest, content_type, data in blobs])
+            cursor.executemany('INSERT OR IGNORE INTO blob_data (digest, data) VALUES (?, ?)',
+                               [(digest, data) for digest, _, data in blobs])
+            
+            conn.commit()
+    
+    @timed_query
+    def get_blob_data(self, digest: str) -> Optional[bytes]:
+        """Get the bytes of a blob kept in the database"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT data FROM blob_data WHERE digest = ?', (digest,))
+            result = cursor.fetchone()
         
-        # Fix any existing data issues
-        self.fix_existing_data()
+        return bytes(result[0]) if result else None
+    
+    @timed_query
+    def has_blob_data(self, digest: str) -> bool:
+        """Check whether the bytes of a blob are kept in the database, without reading them"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT 1 FROM blob_data WHERE digest = ?', (digest,))
+            return cursor.fetchone() is not None
+    
+    @timed_query
+    def delete_blob_data(self, digest: str) -> bool:
+        """Delete the bytes of a blob kept in the database, returning whether they existed"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM blob_data WHERE digest = ?', (digest,))
+            deleted = cursor.rowcount > 0
+            conn.commit()
+        return deleted
     
     def save_prediction(self, model_name: str, predicted_class: str, confidence: float,
                        file_name: str, file_size: int, file_type: str,
-                       image_data: Optional[str] = None, heatmap_data: Optional[str] = None) -> int:
+                       image_blob: Optional[str] = None, heatmap_blob: Optional[str] = None) -> int:
         """Save a prediction to the database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        return self.save_predictions([{
+            'model_name': model_name,
+            'predicted_class': predicted_class,
+            'confidence': confidence,
+            'file_name': file_name,
+            'file_size': file_size,
+            'file_type': file_type,
+            'image_blob': image_blob,
+            'heatmap_blob': heatmap_blob
+        }])[0]
+    
+    @timed_query
+    def save_predictions(self, predictions: List[Dict]) -> List[int]:
+        """Save several predictions in a single transaction
         
-        # Ensure confidence is a float
-        try:
-            confidence = float(confidence)
-        except (ValueError, TypeError):
-            confidence = 0.0
+        Images are referenced by blob digest (``image_blob``/``heatmap_blob``/``thumb_blob``);
+        inline ``image_data``/``heatmap_data`` data URLs are moved to the blob store.
+        ``cascade_stages`` (a list of stage dicts) is stored as JSON.
+        """
+        for pred in predictions:
+            if pred.get('image_data') and not pred.get('image_blob'):
+                pred['image_blob'] = self.blob_store.put_data_url(pred['image_data'])
+            if pred.get('heatmap_data') and not pred.get('heatmap_blob'):
+                pred['heatmap_blob'] = self.blob_store.put_data_url(pred['heatmap_data'])
         
-        cursor.execute('''
-            INSERT INTO predictions 
-            (timestamp, model_name, predicted_class, confidence, file_name, file_size, file_type, image_data, heatmap_data)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (datetime.now(), model_name, predicted_class, confidence, file_name, file_size, file_type, image_data, heatmap_data))
+        rows = []
+        timestamp = datetime.now()
+        for pred in predictions:
+            # Ensure confidence is a float
+            try:
+                confidence = float(pred['confidence'])
+            except (ValueError, TypeError):
+                confidence = 0.0
+            cascade_stages = json.dumps(pred['cascade_stages']) if pred.get('cascade_stages') else None
+            rows.append((timestamp, pred['model_name'], pred['predicted_class'], confidence, pred['file_name'],
+                         pred['file_size'], pred['file_type'], pred.get('image_blob'), pred.get('heatmap_blob'),
+                         pred.get('thumb_blob'), cascade_stages))
+        if not rows:
+            return []
         
-        prediction_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.executemany('''
+                INSERT INTO predictions 
+                (timestamp, model_name, predicted_class, confidence, file_name, file_size, file_type,
+                 image_blob, heatmap_blob, thumb_blob, cascade_stages)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+            # The transaction holds the write lock, so the rows got consecutive ids
+            last_id = cursor.execute('SELECT last_insert_rowid()').fetchone()[0]
+            
+            conn.commit()
         
-        return prediction_id
+        return list(range(last_id - len(rows) + 1, last_id + 1))
     
-    def get_prediction_history(self, limit: int = 50, offset: int = 0) -> List[Dict]:
-        """Get prediction history with pagination"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+    @timed_query
+    def get_prediction_history(self, limit: int = 50, offset: int = 0,
+                               before_ts: Optional[str] = None, after_id: Optional[int] = None,
+                               after_ts: Optional[str] = None, before_id: Optional[int] = None,
+                               model_name: Optional[str] = None, predicted_class: Optional[str] = None,
+                               min_confidence: Optional[float] = None, max_confidence: Optional[float] = None,
+                               start_date: Optional[str] = None, end_date: Optional[str] = None) -> List[Dict]:
+        """Get prediction history, newest first, with keyset or offset pagination
         
-        cursor.execute('''
-            SELECT id, timestamp, model_name, predicted_class, confidence, file_name, file_size, file_type
-            FROM predictions
-            ORDER BY timestamp DESC
-            LIMIT ? OFFSET ?
-        ''', (limit, offset))
-        
-        results = []
-        for row in cursor.fetchall():
-            row_dict = dict(row)
-            # Ensure confidence is a float
-            if isinstance(row_dict['confidence'], (bytes, str)):
-                try:
-                    row_dict['confidence'] = float(row_dict['confidence'])
-                except (ValueError, TypeError):
+        ``before_ts``/``after_id`` select the page following a row (older
+        predictions) and ``after_ts``/``before_id`` the page preceding it (newer
+        predictions). When only the id of the cursor row is given its timestamp is
+        looked up. ``offset`` is only applied when no cursor is given.
+        """
+        clauses, params = self._history_filters(model_name, predicted_class, min_confidence,
+                                                max_confidence, start_date, end_date)
+        
+        newer = after_ts is not None or before_id is not None
+        cursor_ts, cursor_id = (after_ts, before_id) if newer else (before_ts, after_id)
+        operator = '>' if newer else '<'
+        if cursor_id is not None:
+            # Row-value comparison keeps the (timestamp, id) index usable
+            clauses.append(f'(timestamp, id) {operator} (COALESCE(?, (SELECT timestamp FROM predictions WHERE id = ?)), ?)')
+            params.extend([cursor_ts, cursor_id, cursor_id])
+        elif cursor_ts is not None:
+            clauses.append(f'timestamp {operator} ?')
+            params.append(cursor_ts)
+        
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        order = 'ASC' if newer else 'DESC'
+        if cursor_ts is None and cursor_id is None:
+            pagination, params = 'LIMIT ? OFFSET ?', params + [limit, offset]
+        else:
+            pagination, params = 'LIMIT ?', params + [limit]
+        
+        with self.pool.connection() as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+            
+            cursor.execute(f'''
+                SELECT id, timestamp, model_name, predicted_class, confidence, file_name, file_size, file_type,
+                       (thumb_blob IS NOT NULL OR image_blob IS NOT NULL) AS has_thumbnail
+                FROM predictions
+                {where}
+                ORDER BY timestamp {order}, id {order}
+                {pagination}
+            ''', params)
+            
+            results = []
+            for row in cursor.fetchall():
+                row_dict = dict(row)
+                # Ensure confidence is a float
+                if isinstance(row_dict['confidence'], (bytes, str)):
+                    try:
+                        row_dict['confidence'] = float(row_dict['confidence'])
+                    except (ValueError, TypeError):
+                        row_dict['confidence'] = 0.0
+                elif row_dict['confidence'] is None:
                     row_dict['confidence'] = 0.0
-            elif row_dict['confidence'] is None:
-                row_dict['confidence'] = 0.0
-            results.append(row_dict)
+                results.append(row_dict)
         
-        conn.close()
+        # Pages of newer predictions are read oldest first; present them newest first
+        if newer:
+            results.reverse()
         return results
     
-    def get_prediction_by_id(self, prediction_id: int) -> Optional[Dict]:
-        """Get a specific prediction by ID"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+    @timed_query
+    def get_export_chunk(self, after_ts: Optional[str] = None, after_id: Optional[int] = None,
+                         limit: int = EXPORT_CHUNK_SIZE, **filters) -> List[tuple]:
+        """Get the next chunk of export rows in (timestamp, id) order after the given position"""
+        clauses, params = self._history_filters(**filters)
+        if after_id is not None:
+            clauses.append('(timestamp, id) > (?, ?)')
+            params.extend([after_ts, after_id])
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
         
-        cursor.execute('''
-            SELECT * FROM predictions WHERE id = ?
-        ''', (prediction_id,))
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT id, timestamp, model_name, predicted_class, confidence, file_name, file_size, file_type
+                FROM predictions
+                {where}
+                ORDER BY timestamp, id
+                LIMIT ?
+            ''', params + [limit])
+            rows = cursor.fetchall()
         
-        result = cursor.fetchone()
-        conn.close()
+        return rows
+    
+    @staticmethod
+    def _history_filters(model_name: Optional[str] = None, predicted_class: Optional[str] = None,
+                         min_confidence: Optional[float] = None, max_confidence: Optional[float] = None,
+                         start_date: Optional[str] = None, end_date: Optional[str] = None):
+        """Build WHERE clauses and parameters for the history filters"""
+        clauses, params = [], []
+        if model_name:
+            clauses.append('model_name = ?')
+            params.append(model_name)
+        if predicted_class:
+            clauses.append('predicted_class = ?')
+            params.append(predicted_class)
+        if min_confidence is not None:
+            clauses.append('confidence >= ?')
+            params.append(float(min_confidence))
+        if max_confidence is not None:
+            clauses.append('confidence <= ?')
+            params.append(float(max_confidence))
+        if start_date:
+            clauses.append('timestamp >= ?')
+            params.append(str(start_date))
+        if end_date:
+            # End date is inclusive
+            clauses.append("timestamp < date(?, '+1 day')")
+            params.append(str(end_date))
+        return clauses, params
+    
+    @timed_query
+    def get_prediction_by_id(self, prediction_id: int) -> Optional[Dict]:
+        """Get a specific prediction by ID"""
+        with self.pool.connection() as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                SELECT id, timestamp, model_name, predicted_class, confidence, file_name, file_size, file_type,
+                       image_blob, heatmap_blob, thumb_blob, cascade_stages
+                FROM predictions WHERE id = ?
+            ''', (prediction_id,))
+            
+            result = cursor.fetchone()
         
         if result:
             row_dict = dict(result)
@@ -131,48 +785,80 @@ class PredictionDatabase:
                     row_dict['confidence'] = 0.0
             elif row_dict['confidence'] is None:
                 row_dict['confidence'] = 0.0
+            if row_dict['cascade_stages']:
+                row_dict['cascade_stages'] = json.loads(row_dict['cascade_stages'])
             return row_dict
         return None
     
-    def get_prediction_statistics(self) -> Dict:
-        """Get statistics about predictions"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Total predictions
-        cursor.execute('SELECT COUNT(*) FROM predictions')
-        total_predictions = cursor.fetchone()[0]
-        
-        # Most common diseases
-        cursor.execute('''
-            SELECT predicted_class, COUNT(*) as count
-            FROM predictions
-            GROUP BY predicted_class
-            ORDER BY count DESC
-            LIMIT 5
-        ''')
-        common_diseases = cursor.fetchall()
-        
-        # Average confidence
-        cursor.execute('SELECT AVG(CAST(confidence AS REAL)) FROM predictions')
-        avg_confidence = cursor.fetchone()[0] or 0
-        
-        # Predictions by model
-        cursor.execute('''
-            SELECT model_name, COUNT(*) as count
-            FROM predictions
-            GROUP BY model_name
-        ''')
-        predictions_by_model = cursor.fetchall()
-        
-        # Recent predictions (last 7 days)
-        cursor.execute('''
-            SELECT COUNT(*) FROM predictions
-            WHERE timestamp >= datetime('now', '-7 days')
-        ''')
-        recent_predictions = cursor.fetchone()[0]
+    @timed_query
+    def set_prediction_blob(self, prediction_id: int, column: str, digest: Optional[str]):
+        """Point one of the blob references of a prediction at another blob"""
+        if ('predictions', column) not in self.BLOB_REFERENCES:
+            raise ValueError(f"Not a blob reference: {column}")
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'UPDATE predictions SET {column} = ? WHERE id = ?', (digest, prediction_id))
+            conn.commit()
+    
+    @timed_query
+    def delete_prediction(self, prediction_id: int) -> bool:
+        """Delete a prediction, returning whether it existed"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM predictions WHERE id = ?', (prediction_id,))
+            deleted = cursor.rowcount > 0
+            conn.commit()
+        return deleted
+    
+    def clear_predictions(self):
+        """Delete the whole prediction history"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM predictions')
+            conn.commit()
+    
+    def clear_all_data(self):
+        """Delete predictions, cached results and disease info, then restore the disease guide"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM predictions')
+            cursor.execute('DELETE FROM prediction_cache')
+            cursor.execute('DELETE FROM disease_info')
+            conn.commit()
         
-        conn.close()
+        # Reinitialize disease info
+        self.populate_disease_info()
+    
+    @timed_query
+    def get_prediction_statistics(self) -> Dict:
+        """Get statistics about predictions from the rollup tables"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            
+            # Totals and average confidence
+            cursor.execute('SELECT COALESCE(SUM(prediction_count), 0), SUM(confidence_sum) FROM stats_by_model')
+            total_predictions, confidence_sum = cursor.fetchone()
+            avg_confidence = confidence_sum / total_predictions if total_predictions else 0
+            
+            # Most common diseases
+            cursor.execute('''
+                SELECT predicted_class, prediction_count
+                FROM stats_by_class
+                ORDER BY prediction_count DESC
+                LIMIT 5
+            ''')
+            common_diseases = cursor.fetchall()
+            
+            # Predictions by model
+            cursor.execute('SELECT model_name, prediction_count FROM stats_by_model ORDER BY model_name')
+            predictions_by_model = cursor.fetchall()
+            
+            # Recent predictions (last 7 days, to the hour)
+            cursor.execute('''
+                SELECT COALESCE(SUM(prediction_count), 0) FROM stats_by_hour
+                WHERE hour >= strftime('%Y-%m-%d %H:00:00', 'now', '-7 days')
+            ''')
+            recent_predictions = cursor.fetchone()[0]
         
         return {
             'total_predictions': total_predictions,
@@ -182,31 +868,186 @@ class PredictionDatabase:
             'recent_predictions': recent_predictions
         }
     
-    def get_disease_info(self, disease_name: Optional[str] = None) -> List[Dict]:
-        """Get disease information"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+    @timed_query
+    def get_prediction_timeseries(self, granularity: str = 'day', start_date: Optional[str] = None,
+                                  end_date: Optional[str] = None) -> List[Dict]:
+        """Get prediction counts and average confidence per day or hour from the rollups"""
+        if granularity not in ('day', 'hour'):
+            raise ValueError(f"Unsupported granularity: {granularity}")
+        period = 'substr(hour, 1, 10)' if granularity == 'day' else 'hour'
+        
+        conditions, params = [], []
+        if start_date:
+            conditions.append('hour >= ?')
+            params.append(start_date)
+        if end_date:
+            conditions.append("hour < date(?, '+1 day')")
+            params.append(end_date)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT {period} AS period, SUM(prediction_count), SUM(confidence_sum)
+                FROM stats_by_hour
+                {where}
+                GROUP BY period
+                ORDER BY period
+            ''', params)
+            rows = cursor.fetchall()
+        
+        return [
+            {'period': period, 'count': count, 'avg_confidence': round(confidence_sum / count, 2) if count else 0}
+            for period, count, confidence_sum in rows
+        ]
+    
+    @timed_query
+    def get_cached_result(self, image_hash: str, model_name: str, model_version: str) -> Optional[Dict]:
+        """Get a cached prediction result for an image and model version"""
+        with self.pool.connection() as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                SELECT predicted_class, confidence, heatmap_blob FROM prediction_cache
+                WHERE image_hash = ? AND model_name = ? AND model_version = ?
+            ''', (image_hash, model_name, model_version))
+            
+            result = cursor.fetchone()
         
+        return dict(result) if result else None
+    
+    @timed_query
+    def save_cached_result(self, image_hash: str, model_name: str, model_version: str,
+                           predicted_class: str, confidence: float, heatmap_blob: Optional[str] = None):
+        """Store a prediction result in the persistent result cache"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                INSERT OR REPLACE INTO prediction_cache
+                (image_hash, model_name, model_version, predicted_class, confidence, heatmap_blob, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (image_hash, model_name, model_version, predicted_class, float(confidence), heatmap_blob, datetime.now()))
+            
+            conn.commit()
+    
+    @timed_query
+    def delete_cached_results(self, model_name: str, keep_version: Optional[str] = None) -> int:
+        """Delete cached results of a model, except those of ``keep_version``"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                DELETE FROM prediction_cache WHERE model_name = ? AND model_version != ?
+            ''', (model_name, keep_version or ''))
+            
+            deleted = cursor.rowcount
+            conn.commit()
+        
+        return deleted
+    
+    def get_disease_info(self, disease_name: Optional[str] = None) -> List[Dict]:
+        """Get disease information, ranked by relevance when searching"""
         if disease_name:
-            cursor.execute('SELECT * FROM disease_info WHERE disease_name LIKE ?', (f'%{disease_name}%',))
-        else:
+            return self.search_disease_info(disease_name)
+        
+        with self.pool.connection() as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
             cursor.execute('SELECT * FROM disease_info ORDER BY disease_name')
+            results = [dict(row) for row in cursor.fetchall()]
+        
+        return results
+    
+    @timed_query
+    def search_disease_info(self, query: str, limit: int = 50) -> List[Dict]:
+        """Full-text search of the disease guide
+        
+        Every word of the query must match a word prefix in any text column.
+        Results are ordered by bm25 and carry ``name_highlight`` and ``snippet``
+        with matches wrapped in HIGHLIGHT_START/HIGHLIGHT_END markers.
+        """
+        terms = re.findall(r'\w+', query.lower())
+        if not terms:
+            return self.get_disease_info()
         
-        results = [dict(row) for row in cursor.fetchall()]
-        conn.close()
+        cache_key = f"{limit}:{' '.join(terms)}"
+        with self._disease_search_lock:
+            results = self._disease_search_cache.get(cache_key)
+            if results is not None:
+                self._disease_search_cache.move_to_end(cache_key)
+                return results
+        
+        try:
+            results = self._search_disease_fts(terms, limit)
+        except sqlite3.OperationalError:
+            # No FTS5 index in this database
+            results = self._search_disease_like(terms, limit)
+        
+        with self._disease_search_lock:
+            self._disease_search_cache[cache_key] = results
+            while len(self._disease_search_cache) > DISEASE_SEARCH_CACHE_SIZE:
+                self._disease_search_cache.popitem(last=False)
+        return results
+    
+    def _search_disease_fts(self, terms: List[str], limit: int) -> List[Dict]:
+        # Quote every term so user input can never form FTS5 query syntax
+        match = ' '.join(f'"{term}"*' for term in terms)
+        weights = ', '.join(str(weight) for _, weight in self.DISEASE_SEARCH_COLUMNS)
+        
+        with self.pool.connection() as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT d.*,
+                       highlight(disease_info_fts, 0, ?, ?) AS name_highlight,
+                       snippet(disease_info_fts, -1, ?, ?, '…', 16) AS snippet,
+                       bm25(disease_info_fts, {weights}) AS rank
+                FROM disease_info_fts
+                JOIN disease_info d ON d.id = disease_info_fts.rowid
+                WHERE disease_info_fts MATCH ?
+                ORDER BY rank
+                LIMIT ?
+            ''', (HIGHLIGHT_START, HIGHLIGHT_END, HIGHLIGHT_START, HIGHLIGHT_END, match, limit))
+            results = [dict(row) for row in cursor.fetchall()]
         
         return results
     
+    def _search_disease_like(self, terms: List[str], limit: int) -> List[Dict]:
+        columns = ' || \' \' || '.join(name for name, _ in self.DISEASE_SEARCH_COLUMNS)
+        clauses = ' AND '.join(f"({columns}) LIKE ?" for _ in terms)
+        
+        with self.pool.connection() as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT * FROM disease_info
+                WHERE {clauses}
+                ORDER BY disease_name
+                LIMIT ?
+            ''', [f'%{term}%' for term in terms] + [limit])
+            results = [dict(row) for row in cursor.fetchall()]
+        
+        return results
+    
+    def _invalidate_disease_search(self):
+        with self._disease_search_lock:
+            self._disease_search_cache.clear()
+    
     def populate_disease_info(self):
         """Populate the disease info table with initial data"""
-        conn = sqlite3.connect(self.db_path)
+        with self.pool.connection() as conn:
+            self._populate_disease_info(conn)
+        
+        self._invalidate_disease_search()
+    
+    def _populate_disease_info(self, conn):
         cursor = conn.cursor()
         
         # Check if already populated
         cursor.execute('SELECT COUNT(*) FROM disease_info')
         if cursor.fetchone()[0] > 0:
-            conn.close()
             return
         
         disease_data = [
@@ -247,30 +1088,29 @@ class PredictionDatabase:
         ''', disease_data)
         
         conn.commit()
-        conn.close()
 
-    def fix_existing_data(self):
-        """Fix any existing data with incorrect data types"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    def fix_existing_data(self, first_id: Optional[int] = None, last_id: Optional[int] = None) -> int:
+        """Store confidence values kept as text or blobs as numbers, returning how many were fixed
         
-        # Get all predictions
-        cursor.execute('SELECT id, confidence FROM predictions')
-        predictions = cursor.fetchall()
+        ``first_id``/``last_id`` restrict the repair to an id range so large
+        tables can be fixed in short transactions.
+        """
+        with self.pool.connection() as conn:
+            return self._fix_confidence_values(conn, first_id, last_id)
+    
+    def _fix_confidence_values(self, conn, first_id: Optional[int] = None, last_id: Optional[int] = None) -> int:
+        cursor = conn.cursor()
         
-        # Fix confidence values
-        for pred_id, confidence in predictions:
-            if isinstance(confidence, (bytes, str)):
-                try:
-                    fixed_confidence = float(confidence)
-                except (ValueError, TypeError):
-                    fixed_confidence = 0.0
-                
-                cursor.execute('UPDATE predictions SET confidence = ? WHERE id = ?', 
-                             (fixed_confidence, pred_id))
+        # CAST yields 0.0 for values that do not parse as a number
+        cursor.execute('''
+            UPDATE predictions SET confidence = CAST(confidence AS REAL)
+            WHERE typeof(confidence) IN ('text', 'blob')
+              AND id BETWEEN COALESCE(?, id) AND COALESCE(?, id)
+        ''', (first_id, last_id))
+        fixed = cursor.rowcount
         
         conn.commit()
-        conn.close()
+        return fixed
 
 # Global database instance
 db = PredictionDatabase()
@@ -0,0 +1,75 @@
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict
+
+from fastapi import HTTPException
+
+from config import CPU_MAX_PENDING, CPU_WORKERS, DB_MAX_PENDING, DB_WORKERS
+
+
+class ServiceOverloaded(HTTPException):
+    """Raised when an executor queue is full so the request is shed with HTTP 503"""
+
+    def __init__(self, name: str):
+        super().__init__(status_code=503, detail=f"Server is busy ({name} queue full), please retry shortly.",
+                         headers={"Retry-After": "1"})
+
+
+class BoundedExecutor:
+    """Thread pool with a bounded number of running plus queued tasks
+
+    TensorFlow, OpenCV, PIL and sqlite3 release the GIL in their hot loops, and
+    the loaded models live in this process, so threads are used rather than a
+    process pool.
+    """
+
+    def __init__(self, name: str, max_workers: int, max_pending: int):
+        self.name = name
+        self.max_workers = max_workers
+        self.capacity = max_workers + max_pending
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._slots = threading.BoundedSemaphore(self.capacity)
+        self._in_flight = 0
+        self._rejected = 0
+        self._lock = threading.Lock()
+
+    async def run(self, fn: Callable, *args, **kwargs):
+        """Run ``fn`` in the pool and await its result, or raise ServiceOverloaded"""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise ServiceOverloaded(self.name)
+        with self._lock:
+            self._in_flight += 1
+        try:
+            future = self._pool.submit(functools.partial(fn, *args, **kwargs))
+        except BaseException:
+            self._release()
+            raise
+        # Free the slot when the task finishes (or is cancelled), not when the caller stops waiting
+        future.add_done_callback(lambda _: self._release())
+        return await asyncio.wrap_future(future)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'workers': self.max_workers,
+                'capacity': self.capacity,
+                'in_flight': self._in_flight,
+                'rejected': self._rejected,
+            }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
+
+    def _release(self):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+
+# Global executors: CPU-bound image/model work and database access
+cpu_executor = BoundedExecutor("cpu", CPU_WORKERS, CPU_MAX_PENDING)
+db_executor = BoundedExecutor("db", DB_WORKERS, DB_MAX_PENDING)
@@ -0,0 +1,165 @@
+import csv
+import io
+import json
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+# Exported columns: (database column, CSV header)
+EXPORT_FIELDS = [
+    ('timestamp', 'Date'),
+    ('model_name', 'Model'),
+    ('predicted_class', 'Prediction'),
+    ('confidence', 'Confidence'),
+    ('file_name', 'File Name'),
+    ('file_size', 'File Size'),
+    ('file_type', 'File Type'),
+]
+
+
+class CsvEncoder:
+    media_type = "text/csv"
+    extension = "csv"
+
+    def __init__(self):
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer)
+
+    def header(self) -> bytes:
+        self._writer.writerow([title for _, title in EXPORT_FIELDS])
+        return self._drain()
+
+    def encode(self, rows: List[Dict]) -> bytes:
+        self._writer.writerows([[row[name] for name, _ in EXPORT_FIELDS] for row in rows])
+        return self._drain()
+
+    def finish(self) -> bytes:
+        return b""
+
+    def _drain(self) -> bytes:
+        data = self._buffer.getvalue().encode()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return data
+
+
+class JsonlEncoder:
+    media_type = "application/x-ndjson"
+    extension = "jsonl"
+
+    def header(self) -> bytes:
+        return b""
+
+    def encode(self, rows: List[Dict]) -> bytes:
+        return "".join(json.dumps({name: row[name] for name, _ in EXPORT_FIELDS}) + "\n" for row in rows).encode()
+
+    def finish(self) -> bytes:
+        return b""
+
+
+class _ByteSink:
+    """Write-only file object whose contents are handed out as they are produced"""
+
+    closed = False
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class ParquetEncoder:
+    """Parquet file written one row group per chunk; needs the optional pyarrow package"""
+
+    media_type = "application/vnd.apache.parquet"
+    extension = "parquet"
+
+    def __init__(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self._pa = pa
+        self._schema = pa.schema([
+            ('timestamp', pa.string()),
+            ('model_name', pa.string()),
+            ('predicted_class', pa.string()),
+            ('confidence', pa.float64()),
+            ('file_name', pa.string()),
+            ('file_size', pa.int64()),
+            ('file_type', pa.string()),
+        ])
+        self._sink = _ByteSink()
+        self._writer = pq.ParquetWriter(self._sink, self._schema, compression='snappy')
+
+    def header(self) -> bytes:
+        return self._sink.drain()
+
+    def encode(self, rows: List[Dict]) -> bytes:
+        columns = {name: [row[name] for row in rows] for name, _ in EXPORT_FIELDS}
+        columns['timestamp'] = [str(value) for value in columns['timestamp']]
+        columns['confidence'] = [float(value) for value in columns['confidence']]
+        self._writer.write_table(self._pa.Table.from_pydict(columns, schema=self._schema))
+        return self._sink.drain()
+
+    def finish(self) -> bytes:
+        self._writer.close()
+        return self._sink.drain()
+
+
+EXPORT_ENCODERS = {
+    'csv': CsvEncoder,
+    'jsonl': JsonlEncoder,
+    'parquet': ParquetEncoder,
+}
+
+
+def parquet_available() -> bool:
+    try:
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+async def stream_export(fetch_chunk: Callable[[Optional[str], Optional[int]], Awaitable[List[tuple]]],
+                        encoder) -> AsyncIterator[bytes]:
+    """Yield an encoded export chunk by chunk
+
+    ``fetch_chunk(after_ts, after_id)`` returns the next rows (id first, then the
+    exported columns) following the given keyset position, so only one chunk is
+    held in memory at a time.
+    """
+    data = encoder.header()
+    if data:
+        yield data
+
+    after_ts, after_id = None, None
+    while True:
+        rows = await fetch_chunk(after_ts, after_id)
+        if not rows:
+            break
+        after_id, after_ts = rows[-1][0], rows[-1][1]
+        data = encoder.encode([dict(zip([name for name, _ in EXPORT_FIELDS], row[1:])) for row in rows])
+        if data:
+            yield data
+
+    data = encoder.finish()
+    if data:
+        yield data
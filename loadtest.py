@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+"""
+Load generator for the HTTP endpoints.
+
+Drives uploads (POST /), the history page, statistics, prediction details and
+the CSV export with a weighted request mix, either against a running instance
+(--url) or against the app started in-process (the default; it uses the
+application's models but a throwaway database and blob directory, so test
+uploads never reach the real history and statistics).
+
+Closed loop: --concurrency workers each send their next request as soon as the
+previous one finished. Open loop: requests arrive at --rate per second whether
+or not earlier ones finished, and latency is measured from the scheduled
+arrival, so queueing shows up in the percentiles. Several rates run one after
+the other to find the saturation point.
+
+    python loadtest.py --concurrency 16 --duration 60
+    python loadtest.py --url http://localhost:8000 --rate 2 4 8 16 --duration 30
+    python loadtest.py --mix upload=1 --models auto --json uploads.json
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import httpx
+import numpy as np
+from PIL import Image
+
+import config
+from config import CLASS_NAMES, DEFAULT_EXPLAIN_MODE, EXPLAIN_MODES
+
+ENDPOINTS = ("upload", "history", "statistics", "detail", "export")
+DEFAULT_MIX = "upload=6,history=1,statistics=1,detail=1,export=1"
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+
+# Camera-like upload sizes the synthetic corpus cycles through
+CORPUS_SIZES = ((640, 480), (1280, 960), (2048, 1536), (4032, 3024))
+
+
+def synthetic_corpus(count, seed):
+    """(file name, JPEG bytes) pairs of random images in several sizes"""
+    rng = np.random.default_rng(seed)
+    corpus = []
+    for i in range(count):
+        width, height = CORPUS_SIZES[i % len(CORPUS_SIZES)]
+        # Upscaled low-resolution noise compresses like a photo rather than like white noise
+        small = rng.integers(0, 255, (height // 16, width // 16, 3), dtype=np.uint8)
+        output = io.BytesIO()
+        Image.fromarray(small).resize((width, height), Image.BICUBIC).save(output, format='JPEG', quality=90)
+        corpus.append((f"synthetic_{i}.jpg", output.getvalue()))
+    return corpus
+
+
+def load_corpus(directory, limit):
+    """(file name, bytes) pairs of the images found under a directory"""
+    corpus = []
+    for root, _, names in os.walk(directory):
+        for name in sorted(names):
+            if name.lower().endswith(IMAGE_EXTENSIONS) and len(corpus) < limit:
+                with open(os.path.join(root, name), 'rb') as f:
+                    corpus.append((name, f.read()))
+    return corpus
+
+
+def parse_mix(text):
+    """Parse "upload=6,history=1" into endpoint names and weights"""
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f"unknown endpoint '{name}' (choose from {', '.join(ENDPOINTS)})")
+        mix[name] = float(weight or 1)
+    if not any(weight > 0 for weight in mix.values()):
+        raise argparse.ArgumentTypeError("the request mix needs a positive weight")
+    return mix
+
+
+class EndpointStats:
+    """Latencies and outcomes of the requests sent to one endpoint"""
+
+    def __init__(self):
+        self.latencies = []
+        self.statuses = Counter()
+        self.errors = 0
+        self.dropped = 0
+
+    def record(self, latency, status, error):
+        self.latencies.append(latency)
+        self.statuses[str(status)] += 1
+        if error:
+            self.errors += 1
+
+    def summary(self, elapsed):
+        ms = np.array(self.latencies) * 1000 if self.latencies else np.zeros(1)
+        attempted = len(self.latencies) + self.dropped
+        return {
+            'requests': len(self.latencies),
+            'errors': self.errors,
+            'dropped': self.dropped,
+            'error_rate': round((self.errors + self.dropped) / attempted, 4) if attempted else 0.0,
+            'throughput_per_s': round((len(self.latencies) - self.errors) / elapsed, 2) if elapsed else 0.0,
+            'p50_ms': round(float(np.percentile(ms, 50)), 2),
+            'p95_ms': round(float(np.percentile(ms, 95)), 2),
+            'p99_ms': round(float(np.percentile(ms, 99)), 2),
+            'max_ms': round(float(ms.max()), 2),
+            'statuses': dict(self.statuses),
+        }
+
+
+class LoadTest:
+    """Picks requests from the mix, sends them and records the outcomes"""
+
+    def __init__(self, client, corpus, args):
+        self.client = client
+        self.corpus = corpus
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.endpoints = list(args.mix.keys())
+        self.weights = list(args.mix.values())
+        self.prediction_ids = []
+        self.stats = {}
+
+    def reset(self):
+        self.stats = {endpoint: EndpointStats() for endpoint in self.endpoints}
+
+    def pick(self):
+        return self.rng.choices(self.endpoints, self.weights)[0]
+
+    async def refresh_prediction_ids(self):
+        """Learn existing prediction ids for the detail requests"""
+        response = await self.client.get("/api/history", params={"limit": 500})
+        if response.status_code == 200:
+            self.prediction_ids = [prediction["id"] for prediction in response.json()["predictions"]]
+
+    async def send(self, endpoint, scheduled_at):
+        try:
+            response = await self._call(endpoint)
+            status = response.status_code
+            # The upload form reports failures inside a 200 page
+            error = status >= 400 or (endpoint == "upload" and "Error:" in response.text)
+        except Exception as e:
+            status, error = type(e).__name__, True
+        self.stats[endpoint].record(time.perf_counter() - scheduled_at, status, error)
+
+    async def _call(self, endpoint):
+        if endpoint == "upload":
+            file_name, contents = self.rng.choice(self.corpus)
+            return await self.client.post("/", files={"file": (file_name, contents, "image/jpeg")},
+                                          data={"model": self.rng.choice(self.args.models),
+                                                "explain": self.args.explain})
+        if endpoint == "history":
+            return await self.client.get("/history", params={"page": self.rng.randint(1, 3)})
+        if endpoint == "statistics":
+            return await self.client.get("/api/statistics")
+        if endpoint == "detail":
+            prediction_id = self.rng.choice(self.prediction_ids) if self.prediction_ids else 1
+            return await self.client.get(f"/history/{prediction_id}")
+        return await self.client.get("/api/history/export", params={"format": "csv"})
+
+
+async def closed_loop(test, concurrency, duration):
+    """Keep ``concurrency`` requests in flight for ``duration`` seconds"""
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        while time.perf_counter() < deadline:
+            await test.send(test.pick(), time.perf_counter())
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return time.perf_counter() - started
+
+
+async def open_loop(test, rate, duration, max_outstanding, poisson):
+    """Start requests at ``rate`` per second for ``duration`` seconds, then wait for them
+
+    Returns the elapsed time, including draining the backlog, and the number of arrivals.
+    """
+    tasks = set()
+    arrivals = 0
+    started = time.perf_counter()
+    next_at = started
+    while next_at < started + duration:
+        delay = next_at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        endpoint = test.pick()
+        arrivals += 1
+        if len(tasks) >= max_outstanding:
+            # The client itself would become the bottleneck; count the arrival as failed
+            test.stats[endpoint].dropped += 1
+        else:
+            task = asyncio.create_task(test.send(endpoint, next_at))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        next_at += test.rng.expovariate(rate) if poisson else 1.0 / rate
+    if tasks:
+        await asyncio.gather(*tasks)
+    return time.perf_counter() - started, arrivals
+
+
+def report(test, elapsed, label):
+    """Print and return the per-endpoint and overall results of one run"""
+    total = EndpointStats()
+    for stats in test.stats.values():
+        total.latencies.extend(stats.latencies)
+        total.statuses.update(stats.statuses)
+        total.errors += stats.errors
+        total.dropped += stats.dropped
+    endpoints = {endpoint: stats.summary(elapsed) for endpoint, stats in test.stats.items()}
+    endpoints['total'] = total.summary(elapsed)
+
+    print(f"\n{label} ({elapsed:.1f}s)")
+    print(f"{'endpoint':<12} {'requests':>9} {'req/s':>8} {'errors':>7} {'p50 ms':>9} {'p95 ms':>9} "
+          f"{'p99 ms':>9} {'max ms':>9}")
+    for endpoint, summary in endpoints.items():
+        print(f"{endpoint:<12} {summary['requests']:>9} {summary['throughput_per_s']:>8.1f} "
+              f"{summary['error_rate']:>7.1%} {summary['p50_ms']:>9.1f} {summary['p95_ms']:>9.1f} "
+              f"{summary['p99_ms']:>9.1f} {summary['max_ms']:>9.1f}")
+    return {'label': label, 'elapsed_s': round(elapsed, 3), 'endpoints': endpoints}
+
+
+def saturation_point(runs, max_error_rate, slo_ms):
+    """Highest offered rate still served in full, within the error budget and latency objective"""
+    sustained = None
+    for run in runs:
+        total = run['endpoints']['total']
+        # Below saturation the last arrivals finish about as fast as any other request;
+        # above it a backlog builds up and takes long to drain after the last arrival
+        served = run['drain_s'] <= max(1.0, 0.1 * run['duration_s'])
+        healthy = total['error_rate'] <= max_error_rate and (slo_ms is None or total['p99_ms'] <= slo_ms)
+        if served and healthy:
+            sustained = run['rate']
+    return sustained
+
+
+async def run(args):
+    corpus = load_corpus(args.images, args.corpus_size) if args.images else synthetic_corpus(args.corpus_size,
+                                                                                             args.seed)
+    if not corpus:
+        print(f"No images found in {args.images}")
+        return None
+
+    limits = httpx.Limits(max_connections=max(args.concurrency, args.max_outstanding))
+    work_dir = None
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits)
+        lifespan = contextlib.nullcontext()
+        target = args.url
+    else:
+        # Point the app's database and blob store at a scratch directory before
+        # main creates them, so synthetic uploads never land in the real history
+        work_dir = tempfile.mkdtemp(prefix="favdd-loadtest-")
+        config.DATABASE_PATH = os.path.join(work_dir, "predictions.db")
+        config.BLOB_STORE_DIR = os.path.join(work_dir, "blobs")
+        # Imported here so the app (and TensorFlow) only load for in-process runs
+        os.chdir(os.path.dirname(os.path.abspath(__file__)))
+        import main
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://loadtest",
+                                   timeout=args.timeout, limits=limits)
+        lifespan = main.lifespan(main.app)
+        target = "in-process"
+
+    results = {
+        'meta': {
+            'target': target,
+            'mix': args.mix,
+            'models': args.models,
+            'explain': args.explain,
+            'corpus': {'images': len(corpus), 'bytes': sum(len(data) for _, data in corpus)},
+            'duration_s': args.duration,
+            'seed': args.seed,
+        },
+        'runs': [],
+    }
+    try:
+        await run_tests(client, lifespan, corpus, args, results)
+    finally:
+        if work_dir is not None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+async def run_tests(client, lifespan, corpus, args, results):
+    """Warm up, then run the open-loop rates or the closed loop, adding each run to the results"""
+    async with lifespan, client:
+        test = LoadTest(client, corpus, args)
+
+        # Warm up models and caches, and create predictions for the detail requests
+        test.reset()
+        for _ in range(args.warmup):
+            await test.send("upload", time.perf_counter())
+        await test.refresh_prediction_ids()
+
+        if args.rate:
+            for rate in args.rate:
+                test.reset()
+                elapsed, arrivals = await open_loop(test, rate, args.duration, args.max_outstanding,
+                                                    args.arrivals == "poisson")
+                results['runs'].append({'mode': 'open', 'rate': rate, 'duration_s': args.duration,
+                                        'offered_per_s': round(arrivals / args.duration, 2),
+                                        'drain_s': round(max(0.0, elapsed - args.duration), 3),
+                                        **report(test, elapsed, f"Open loop at {rate:g} req/s")})
+            sustained = saturation_point(results['runs'], args.max_error_rate, args.slo_ms)
+            results['saturation_rate'] = sustained
+            print(f"\nHighest sustained rate: {f'{sustained:g} req/s' if sustained else 'none of the tested rates'}")
+        else:
+            test.reset()
+            elapsed = await closed_loop(test, args.concurrency, args.duration)
+            results['runs'].append({'mode': 'closed', 'concurrency': args.concurrency,
+                                    **report(test, elapsed, f"Closed loop with {args.concurrency} workers")})
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Load test the HTTP endpoints")
+    parser.add_argument("--url", help="base URL of a running instance (default: start the app in-process)")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"weighted request mix (default: {DEFAULT_MIX})")
+    parser.add_argument("--models", nargs="+", default=list(CLASS_NAMES), metavar="NAME",
+                        help="models the uploads pick from (default: all)")
+    parser.add_argument("--explain", choices=EXPLAIN_MODES, default=DEFAULT_EXPLAIN_MODE,
+                        help=f"explanation mode of the uploads (default: {DEFAULT_EXPLAIN_MODE})")
+    parser.add_argument("--concurrency", type=int, default=8, help="closed-loop workers (default: 8)")
+    parser.add_argument("--rate", type=float, nargs="+", metavar="RPS",
+                        help="open-loop arrival rates to run one after the other")
+    parser.add_argument("--arrivals", choices=("uniform", "poisson"), default="poisson",
+                        help="open-loop arrival spacing (default: poisson)")
+    parser.add_argument("--max-outstanding", type=int, default=1000,
+                        help="open-loop requests in flight before arrivals are dropped (default: 1000)")
+    parser.add_argument("--duration", type=float, default=30, help="seconds per run (default: 30)")
+    parser.add_argument("--warmup", type=int, default=5, help="untimed uploads before measuring (default: 5)")
+    parser.add_argument("--images", help="directory of upload images (default: synthetic corpus)")
+    parser.add_argument("--corpus-size", type=int, default=20, help="images in the corpus (default: 20)")
+    parser.add_argument("--timeout", type=float, default=60, help="per-request timeout in seconds (default: 60)")
+    parser.add_argument("--max-error-rate", type=float, default=0.01,
+                        help="error rate a sustained open-loop rate may have (default: 0.01)")
+    parser.add_argument("--slo-ms", type=float, help="p99 latency a sustained open-loop rate must meet")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the corpus and request mix (default: 0)")
+    parser.add_argument("--json", metavar="PATH", help="also write the results as JSON")
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    output = os.path.abspath(args.json) if args.json else None
+    results = asyncio.run(run(args))
+    if results is None:
+        sys.exit(1)
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {output}")
@@ -1,26 +1,99 @@
 
-import io
+import time
+_IMPORT_STARTED = time.perf_counter()
+
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from datetime import date
+from urllib.parse import urlencode
 import uvicorn
-from fastapi import FastAPI, File, UploadFile, Form, Request, Query
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi import BackgroundTasks, Depends, FastAPI, File, HTTPException, UploadFile, Form, Request, Query
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, Response, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
+from markupsafe import Markup, escape
 import numpy as np
-import base64
-from io import BytesIO
-from PIL import Image
-from typing import Optional
-
-from config import CLASS_NAMES, IMG_SIZE
+from typing import List, Optional
+
+from config import (
+    AUTO_MODEL,
+    BATCH_DEFAULT_EXPLAIN_MODE,
+    BATCH_MAX_IMAGES,
+    CASCADE_FIRST_MODEL,
+    CLASS_NAMES,
+    DEFAULT_EXPLAIN_MODE,
+    EXPLAIN_MODES,
+    IMAGE_CACHE_MAX_AGE,
+    PRELOAD_MODELS,
+    WARMUP_IN_BACKGROUND
+)
+from preprocessing import make_thumbnail, make_thumbnails, preprocess_image, preprocess_images, thumbnail_content_type
 from utils import (
     apply_heatmap, 
     format_file_size, 
-    generate_gradcam, 
-    load_selected_model
+    encode_heatmap,
+    heatmap_content_type,
+    normalize_heatmap,
+    cv2,
+    tf
     )
-from database import db
-
-app = FastAPI()
+from database import HIGHLIGHT_END, HIGHLIGHT_START, db
+from export import EXPORT_ENCODERS, parquet_available, stream_export
+from blob_store import blob_url, is_valid_digest
+from batching import schedulers
+from cascade import cascade_batch, specialist_for, stage_result
+from executors import ServiceOverloaded, cpu_executor, db_executor
+from metrics import metrics, stage
+from model_registry import registry
+from result_cache import CacheKey, result_cache
+from write_behind import prediction_writer
+
+
+logger = logging.getLogger(__name__)
+
+# Where startup time went, reported once the app is ready
+startup_report = {}
+
+
+def _warmup_models():
+    # Load and warm up models so the first request skips loading and graph tracing
+    started = time.perf_counter()
+    registry.warmup(PRELOAD_MODELS)
+    startup_report["warmup_seconds"] = round(time.perf_counter() - started, 3)
+    logger.info("Model warmup finished in %.2fs", startup_report["warmup_seconds"])
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    startup_report.update({
+        "import_seconds": round(time.perf_counter() - _IMPORT_STARTED, 3),
+        "database_init_seconds": round(db.init_seconds, 3),
+        "migrations_applied": db.applied_migrations,
+        "schema_version": db.get_schema_version(),
+        "migrations_pending": db.get_pending_migrations(),
+        "ml_stack_imported": tf.loaded or cv2.loaded,
+        "warmup_seconds": None
+    })
+    warmup = None
+    if WARMUP_IN_BACKGROUND:
+        warmup = asyncio.create_task(asyncio.to_thread(_warmup_models))
+    else:
+        _warmup_models()
+    startup_report["ready_seconds"] = round(time.perf_counter() - _IMPORT_STARTED, 3)
+    logger.info("Startup report: %s", startup_report)
+    yield
+    if warmup is not None and not warmup.done():
+        await asyncio.wait([warmup])
+    schedulers.shutdown()
+    cpu_executor.shutdown()
+    # Drain queued predictions before the database goes away
+    prediction_writer.close()
+    db_executor.shutdown()
+    db.pool.close_all()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Mount static files (CSS, JS, images, etc.)
 app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -39,6 +112,68 @@ def safe_float_format(value, decimals=1):
 
 # Add the filter to Jinja2 environment
 templates.env.filters['safe_float'] = safe_float_format
+templates.env.globals['auto_model'] = AUTO_MODEL
+
+# Request metrics, labelled by route template so label values stay bounded
+http_requests = metrics.counter("http_requests_total", "HTTP requests by route and status",
+                                ("method", "endpoint", "status"))
+http_request_seconds = metrics.histogram("http_request_duration_seconds", "HTTP request latency by route",
+                                         ("method", "endpoint"))
+http_in_flight = metrics.gauge("http_requests_in_flight", "HTTP requests being served")
+_route_templates = {}
+
+
+def _route_template(request: Request) -> str:
+    """Path template of the route that served a request"""
+    endpoint = request.scope.get("endpoint")
+    if endpoint is None:
+        return "unmatched"
+    template = _route_templates.get(endpoint)
+    if template is None:
+        template = next((route.path for route in app.routes
+                         if getattr(route, "endpoint", getattr(route, "app", None)) is endpoint), "unmatched")
+        _route_templates[endpoint] = template
+    return template
+
+
+if metrics.enabled:
+    @app.middleware("http")
+    async def record_request_metrics(request: Request, call_next):
+        http_in_flight.inc()
+        started = time.perf_counter()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            http_in_flight.dec()
+            endpoint = _route_template(request)
+            http_request_seconds.observe(time.perf_counter() - started, method=request.method, endpoint=endpoint)
+            http_requests.inc(method=request.method, endpoint=endpoint, status=status)
+
+
+def _collect_runtime_metrics():
+    # Current values of the components' own statistics, read at scrape time
+    registry_stats = registry.stats()
+    yield ("models_loaded", "gauge", "Keras models resident in memory",
+           [({}, len(registry_stats["loaded_models"]))])
+    yield ("model_memory_bytes", "gauge", "Estimated weight memory of the resident models",
+           [({}, registry_stats["memory_used_bytes"])])
+    yield ("scheduler_queue_depth", "gauge", "Images waiting for a micro-batch",
+           [({"scheduler": name}, stats["queue_depth"]) for name, stats in schedulers.stats().items()])
+    executors = {"cpu": cpu_executor.stats(), "db": db_executor.stats()}
+    yield ("executor_in_flight", "gauge", "Tasks running or queued in an execution pool",
+           [({"pool": name}, stats["in_flight"]) for name, stats in executors.items()])
+    yield ("executor_rejected_total", "counter", "Tasks shed because an execution pool was full",
+           [({"pool": name}, stats["rejected"]) for name, stats in executors.items()])
+    yield ("result_cache_entries", "gauge", "Results held in the in-memory result cache",
+           [({}, result_cache.stats()["entries"])])
+    yield ("write_behind_queue_depth", "gauge", "Prediction records waiting to be written",
+           [({}, prediction_writer.stats()["queue_depth"])])
+
+
+metrics.add_collector(_collect_runtime_metrics)
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -46,82 +181,261 @@ async def index(request: Request):
     return templates.TemplateResponse("index.html", {"request": request, "models": CLASS_NAMES.keys()})
 
 
+def _render_heatmap(image_array: np.ndarray, raw_heatmap: np.ndarray) -> bytes:
+    """Overlay the normalized Grad-CAM heatmap on the image and encode it"""
+    with stage("heatmap_overlay"):
+        superimposed_img = apply_heatmap(image_array[np.newaxis], normalize_heatmap(raw_heatmap))
+    with stage("heatmap_encode"):
+        return encode_heatmap(superimposed_img)
+
+
+async def _store_thumbnail(contents: bytes) -> Optional[str]:
+    """Store a thumbnail of image bytes, returning its digest (None when they cannot be decoded)"""
+    try:
+        thumbnail = await cpu_executor.run(make_thumbnail, contents)
+    except ServiceOverloaded:
+        raise
+    except Exception:
+        return None
+    return await db_executor.run(db.blob_store.put, thumbnail, thumbnail_content_type())
+
+
+async def _store_upload(contents: bytes, content_type: str):
+    """Store the uploaded bytes and their thumbnail, returning both digests"""
+    image_blob = await db_executor.run(db.blob_store.put, contents, content_type)
+    return image_blob, await _store_thumbnail(contents)
+
+
+def _resolved(value) -> asyncio.Future:
+    future = asyncio.get_running_loop().create_future()
+    future.set_result(value)
+    return future
+
+
+async def _submit_predictions(records: List[dict], direct: bool = False) -> List[asyncio.Future]:
+    """Save prediction records directly, or hand them to the write-behind queue
+    
+    Returns one awaitable per record resolving to its id; with write-behind
+    enabled they resolve once the queue has been flushed. ``direct`` bypasses
+    the queue for callers that need the ids right away.
+    """
+    if direct or not prediction_writer.enabled:
+        return [_resolved(prediction_id) for prediction_id in await db_executor.run(db.save_predictions, records)]
+    return [asyncio.wrap_future(future) for future in prediction_writer.submit_many(records)]
+
+
+async def _persist_predictions(records: List[dict], wait: bool = False) -> List[Optional[int]]:
+    """Save prediction records directly, or hand them to the write-behind queue
+    
+    With write-behind enabled the ids are only awaited when ``wait`` is set;
+    otherwise None is returned for each record.
+    """
+    futures = await _submit_predictions(records)
+    if prediction_writer.enabled and not wait:
+        return [None] * len(records)
+    return [await future for future in futures]
+
+
+def _explain_image(model_name: str, image_array: np.ndarray, predicted_class: str) -> bytes:
+    """Render the Grad-CAM overlay of the recorded class of one image"""
+    class_labels = CLASS_NAMES[model_name]
+    # A negative index explains the top class instead
+    class_index = class_labels.index(predicted_class) if predicted_class in class_labels else -1
+    _, raw_heatmaps = registry.get_gradcam_engine(model_name)(image_array[np.newaxis], class_index)
+    return _render_heatmap(image_array, raw_heatmaps[0])
+
+
+async def _generate_heatmap(prediction_id: int, image_array: Optional[np.ndarray] = None) -> Optional[str]:
+    prediction = await db_executor.run(db.get_prediction_by_id, prediction_id)
+    if prediction is None or prediction["heatmap_blob"] or prediction["model_name"] not in CLASS_NAMES:
+        return prediction["heatmap_blob"] if prediction else None
+    
+    if image_array is None:
+        contents = await db_executor.run(db.blob_store.get, prediction["image_blob"]) if prediction["image_blob"] else None
+        if contents is None:
+            return None
+        image_array = await cpu_executor.run(preprocess_image, contents)
+    
+    heatmap_image = await cpu_executor.run(_explain_image, prediction["model_name"], image_array,
+                                         prediction["predicted_class"])
+    heatmap_blob = await db_executor.run(db.blob_store.put, heatmap_image, heatmap_content_type())
+    await db_executor.run(db.set_prediction_blob, prediction_id, "heatmap_blob", heatmap_blob)
+    
+    # The image blob digest is the SHA-256 of the upload, i.e. the result cache's image hash
+    if prediction["image_blob"]:
+        model_name = prediction["model_name"]
+        cache_key = CacheKey(prediction["image_blob"], model_name, registry.inference_version(model_name))
+        await db_executor.run(result_cache.attach_heatmap, cache_key, prediction["predicted_class"], heatmap_blob)
+    return heatmap_blob
+
+
+# Heatmaps being rendered, by prediction id, so concurrent requests share one job
+_heatmap_jobs = {}
+
+
+async def _ensure_heatmap(prediction_id: int, image_array: Optional[np.ndarray] = None) -> Optional[str]:
+    """Render the heatmap of a stored prediction unless it exists, returning its blob digest"""
+    job = _heatmap_jobs.get(prediction_id)
+    if job is None:
+        job = asyncio.ensure_future(_generate_heatmap(prediction_id, image_array))
+        _heatmap_jobs[prediction_id] = job
+        job.add_done_callback(lambda _: _heatmap_jobs.pop(prediction_id, None))
+    return await asyncio.shield(job)
+
+
+async def _cascade_first_stage(contents: bytes, image_array: np.ndarray, explain: bool):
+    """Classify an upload with the cascade's general model, reusing cached results
+
+    Returns the stage and the raw model outputs (None for cached results). With
+    ``explain`` the model runs on the explain scheduler, so when no specialist
+    applies its outputs already carry the heatmap and the model need not run again.
+    """
+    cache_key = result_cache.make_key(contents, CASCADE_FIRST_MODEL, registry.inference_version(CASCADE_FIRST_MODEL))
+    cached = await db_executor.run(result_cache.get, cache_key)
+    if cached is not None and (cached["heatmap_blob"] or not explain):
+        return {"model": CASCADE_FIRST_MODEL, "predicted_class": cached["predicted_class"],
+                "confidence": cached["confidence"]}, None
+    
+    with stage("predict_explain" if explain else "predict", model=CASCADE_FIRST_MODEL):
+        outputs = await asyncio.wrap_future(schedulers.get(CASCADE_FIRST_MODEL, explain=explain).submit(image_array))
+    first_stage = stage_result(CASCADE_FIRST_MODEL, outputs[0])
+    if first_stage["predicted_class"] is not None and cached is None:
+        await db_executor.run(result_cache.put, cache_key, first_stage["predicted_class"], first_stage["confidence"])
+    return first_stage, outputs
+
+
+async def _explain_later(prediction_id: asyncio.Future, image_array: Optional[np.ndarray]):
+    """Background task rendering a deferred heatmap after the response was sent"""
+    try:
+        await _ensure_heatmap(await prediction_id, image_array)
+    except Exception:
+        # The heatmap endpoint retries on demand
+        logger.exception("Deferred Grad-CAM generation failed")
+
+
 @app.post("/")
-async def create_upload_file(request: Request, file: UploadFile = File(...), model: str = Form(...)):
-    if model not in CLASS_NAMES:
+async def create_upload_file(request: Request, background_tasks: BackgroundTasks, file: UploadFile = File(...),
+                             model: str = Form(...), explain: str = Form(DEFAULT_EXPLAIN_MODE)):
+    if model not in CLASS_NAMES and model != AUTO_MODEL:
         return templates.TemplateResponse("index.html", {
             "request": request, 
             "result": f"Model '{model}' is not recognized.", 
             "models": CLASS_NAMES.keys()
         })
+    if explain not in EXPLAIN_MODES:
+        return templates.TemplateResponse("index.html", {
+            "request": request, 
+            "result": f"Explanation mode '{explain}' is not recognized.", 
+            "models": CLASS_NAMES.keys()
+        })
     
     try:
-        # Load the selected model
-        selected_model = load_selected_model(model)
-        
         # Read the uploaded image file
         contents = await file.read()
         
-        # Save original image data
-        img_io = BytesIO()
-        original_img = Image.open(BytesIO(contents))
-        original_img.save(img_io, format=original_img.format)
-        img_io.seek(0)
-        encoded_image = base64.b64encode(img_io.read()).decode("utf-8")
-        image_data = f"data:{file.content_type};base64,{encoded_image}"
-        
         # Get file info
         file_size = len(contents)
         file_type = file.content_type
         
-        # For prediction, we need to seek back to beginning of file
-        await file.seek(0)
-        contents = await file.read()
+        # Keep the original bytes in the blob store instead of re-encoding them
+        with stage("store_upload", model=model):
+            image_blob, thumb_blob = await _store_upload(contents, file_type)
         
-        image = Image.open(io.BytesIO(contents)).convert("RGB")
-        image = image.resize(IMG_SIZE)
-        image_array = np.array(image) / 255.0  # Normalize the image
-        image_array = np.expand_dims(image_array, axis=0)
+        # The "auto" model asks the general model first and hands uncertain
+        # results over to the specialist of the predicted crop
+        image_array = None
+        cascade_stages = None
+        first_outputs = None
+        if model == AUTO_MODEL:
+            with stage("decode", model=model):
+                image_array = await cpu_executor.run(preprocess_image, contents)
+            first_stage, first_outputs = await _cascade_first_stage(contents, image_array, explain == "eager")
+            cascade_stages = [first_stage]
+            model = specialist_for(cascade_stages[0]) or CASCADE_FIRST_MODEL
         
-        # Get prediction from the model
-        predictions = selected_model.predict(image_array)
-        predicted_class_index = np.argmax(predictions[0])
-        confidence = np.max(predictions[0]) * 100
+        # Serve exact re-uploads from the result cache without touching TensorFlow
+        cache_key = result_cache.make_key(contents, model, registry.inference_version(model))
+        with stage("cache_lookup", model=model):
+            cached = await db_executor.run(result_cache.get, cache_key)
         
-        # Retrieve the class label
-        class_labels = CLASS_NAMES[model]
-        if predicted_class_index < len(class_labels):
-            predicted_class = class_labels[predicted_class_index]
+        if cached is not None and (cached['heatmap_blob'] or explain != "eager"):
+            predicted_class = cached['predicted_class']
+            confidence = cached['confidence']
+            heatmap_blob = cached['heatmap_blob']
             result = f"Prediction: {predicted_class} (Confidence: {confidence:.2f}%)"
         else:
-            result = "Error: Predicted class index out of range."
+            if image_array is None:
+                with stage("decode", model=model):
+                    image_array = await cpu_executor.run(preprocess_image, contents)
+            
+            # Eager explanations get prediction and Grad-CAM heatmap from a single forward+backward
+            # pass, otherwise only the forward pass runs; both are batched with concurrent requests
+            if first_outputs is not None and model == CASCADE_FIRST_MODEL:
+                # No specialist applies: the first stage already ran the general model
+                outputs = first_outputs
+            else:
+                with stage("predict_explain" if explain == "eager" else "predict", model=model):
+                    outputs = await asyncio.wrap_future(schedulers.get(model, explain=explain == "eager").submit(image_array))
+            prediction = outputs[0]
+            predicted_class_index = np.argmax(prediction)
+            confidence = np.max(prediction) * 100
             
-        # Generate Grad-CAM heatmap
-        heatmap = generate_gradcam(selected_model, image_array, predicted_class_index)
+            # Retrieve the class label
+            class_labels = CLASS_NAMES[model]
+            if predicted_class_index < len(class_labels):
+                predicted_class = class_labels[predicted_class_index]
+                result = f"Prediction: {predicted_class} (Confidence: {confidence:.2f}%)"
+            elif cascade_stages is not None:
+                # A specialist answer without a label leaves the general result in place
+                model = CASCADE_FIRST_MODEL
+                cache_key = result_cache.make_key(contents, model, registry.inference_version(model))
+                predicted_class = cascade_stages[0]["predicted_class"]
+                confidence = cascade_stages[0]["confidence"]
+                outputs = first_outputs
+                result = f"Prediction: {predicted_class} (Confidence: {confidence:.2f}%)"
+            else:
+                result = "Error: Predicted class index out of range."
+                
+            # Apply heatmap to the original image and store it
+            heatmap_blob = None
+            if explain == "eager" and outputs is not None:
+                with stage("heatmap_render", model=model):
+                    heatmap_image = await cpu_executor.run(_render_heatmap, image_array, outputs[1])
+                with stage("heatmap_store", model=model):
+                    heatmap_blob = await db_executor.run(db.blob_store.put, heatmap_image, heatmap_content_type())
+            
+            await db_executor.run(result_cache.put, cache_key, predicted_class, confidence, heatmap_blob)
         
-        # Apply heatmap to the original image
-        superimposed_img = apply_heatmap(image_array, heatmap)
+        if cascade_stages is not None and model != CASCADE_FIRST_MODEL:
+            cascade_stages.append({"model": model, "predicted_class": predicted_class, "confidence": float(confidence)})
         
-        # Convert heatmap image to base64
-        heatmap_img = Image.fromarray(superimposed_img)
-        heatmap_io = BytesIO()
-        heatmap_img.save(heatmap_io, format='PNG')
-        heatmap_io.seek(0)
-        heatmap_data = base64.b64encode(heatmap_io.read()).decode('utf-8')
-        heatmap_data = f"data:image/png;base64,{heatmap_data}"
+        # Save prediction to database (queued when write-behind is enabled, unless
+        # the page needs the id to link the heatmap rendered after the response)
+        link_heatmap = heatmap_blob is None and explain == "lazy"
+        with stage("db_save", model=model):
+            prediction_ids = await _submit_predictions([{
+                "model_name": model,
+                "predicted_class": predicted_class,
+                "confidence": confidence,
+                "file_name": file.filename,
+                "file_size": file_size,
+                "file_type": file_type,
+                "image_blob": image_blob,
+                "heatmap_blob": heatmap_blob,
+                "thumb_blob": thumb_blob,
+                "cascade_stages": cascade_stages
+            }], direct=link_heatmap)
+        prediction_id = prediction_ids[0].result() if prediction_ids[0].done() else None
         
-        # Save prediction to database
-        db.save_prediction(
-            model_name=model,
-            predicted_class=predicted_class,
-            confidence=confidence,
-            file_name=file.filename,
-            file_size=file_size,
-            file_type=file_type,
-            image_data=image_data,
-            heatmap_data=heatmap_data
-        )
+        image_data = blob_url(image_blob)
+        heatmap_data = blob_url(heatmap_blob)
+        if link_heatmap:
+            # Render the heatmap once the response has been sent; the page fetches it on demand
+            background_tasks.add_task(_explain_later, prediction_ids[0], image_array)
+            heatmap_data = f"/history/{prediction_id}/heatmap"
         
+    except ServiceOverloaded:
+        raise
     except Exception as e:
         result = f"Error: {str(e)}"
         image_data = None
@@ -140,41 +454,328 @@ async def create_upload_file(request: Request, file: UploadFile = File(...), mod
         "file_size": format_file_size(file_size),
         "file_type": file_type,
         "confidence": confidence if 'confidence' in locals() else None,
-        "predicted_class": predicted_class if 'predicted_class' in locals() else None
+        "predicted_class": predicted_class if 'predicted_class' in locals() else None,
+        "cascade_stages": cascade_stages if 'cascade_stages' in locals() else None
     })
 
 
+def _predict_batch(model: str, batch: np.ndarray, include_heatmap: bool):
+    """Run one model call over the batch, optionally with encoded Grad-CAM overlays"""
+    if not include_heatmap:
+        return registry.get_backend(model).predict(batch), None
+    predictions, heatmaps = registry.get_gradcam_engine(model)(batch)
+    superimposed_imgs = apply_heatmap(batch, normalize_heatmap(heatmaps))
+    return predictions, [encode_heatmap(img) for img in superimposed_imgs]
+
+
+def _predict_cascade_batch(batch: np.ndarray, include_heatmap: bool):
+    """Run the "auto" cascade over the batch, optionally with Grad-CAM overlays of each final model"""
+    stages = cascade_batch(batch, lambda model_name, images: registry.get_backend(model_name).predict(images))
+    if not include_heatmap:
+        return stages, None
+    
+    heatmap_images = [None] * len(batch)
+    rows_by_model = {}
+    for row, image_stages in enumerate(stages):
+        rows_by_model.setdefault(image_stages[-1]["model"], []).append(row)
+    for model_name, rows in rows_by_model.items():
+        _, images = _predict_batch(model_name, batch[rows], True)
+        for row, image in zip(rows, images):
+            heatmap_images[row] = image
+    return stages, heatmap_images
+
+
+@app.post("/api/predict/batch")
+async def predict_batch(background_tasks: BackgroundTasks, files: List[UploadFile] = File(...),
+                        model: str = Form(...), include_heatmap: bool = Form(False),
+                        explain: Optional[str] = Form(None)):
+    """API endpoint to classify many images with a single model call
+    
+    ``explain`` selects when heatmaps are rendered (``include_heatmap`` is a
+    shorthand for ``eager``); deferred heatmaps are served by the
+    /history/{id}/heatmap URL of each result. With the ``auto`` model each
+    result also names the model that decided it and the cascade stages.
+    """
+    if model not in CLASS_NAMES and model != AUTO_MODEL:
+        return JSONResponse(content={"error": f"Model '{model}' is not recognized."}, status_code=404)
+    explain = explain or ("eager" if include_heatmap else BATCH_DEFAULT_EXPLAIN_MODE)
+    if explain not in EXPLAIN_MODES:
+        return JSONResponse(content={"error": f"Explanation mode '{explain}' is not recognized."}, status_code=422)
+    include_heatmap = explain == "eager"
+    if len(files) > BATCH_MAX_IMAGES:
+        return JSONResponse(content={"error": f"At most {BATCH_MAX_IMAGES} images are accepted per batch."},
+                            status_code=413)
+    
+    try:
+        contents_list = [await file.read() for file in files]
+        
+        # Decode all images and encode their thumbnails in parallel, then stack the valid ones into one tensor
+        with stage("batch_decode", model=model):
+            image_arrays, thumbnails = await asyncio.gather(cpu_executor.run(preprocess_images, contents_list),
+                                                            cpu_executor.run(make_thumbnails, contents_list))
+        valid = [i for i, image_array in enumerate(image_arrays) if image_array is not None]
+        results = [{"file_name": file.filename, "error": "Could not decode image"} for file in files]
+        if not valid:
+            return JSONResponse(content={"model": model, "results": results})
+        batch = np.stack([image_arrays[i] for i in valid])
+        
+        with stage("batch_predict_explain" if include_heatmap else "batch_predict", model=model):
+            if model == AUTO_MODEL:
+                stages, heatmap_images = await cpu_executor.run(_predict_cascade_batch, batch, include_heatmap)
+            else:
+                predictions, heatmap_images = await cpu_executor.run(_predict_batch, model, batch, include_heatmap)
+                stages = [[stage_result(model, probabilities)] for probabilities in predictions]
+        
+        # Store the originals, thumbnails and heatmaps of the whole batch in one call and transaction
+        stored = [(row, i) for row, i in enumerate(valid) if stages[row][-1]["predicted_class"] is not None]
+        blobs = []
+        for row, i in stored:
+            blobs.append((contents_list[i], files[i].content_type))
+            if thumbnails[i] is not None:
+                blobs.append((thumbnails[i], thumbnail_content_type()))
+            if include_heatmap:
+                blobs.append((heatmap_images[row], heatmap_content_type()))
+        with stage("batch_store_blobs", model=model):
+            digests = iter(await db_executor.run(db.blob_store.put_many, blobs))
+        
+        records = []
+        for row, i in enumerate(valid):
+            final_stage = stages[row][-1]
+            if final_stage["predicted_class"] is None:
+                results[i] = {"file_name": files[i].filename, "error": "Predicted class index out of range."}
+                continue
+            
+            file_type = files[i].content_type
+            image_blob = next(digests)
+            thumb_blob = next(digests) if thumbnails[i] is not None else None
+            heatmap_blob = next(digests) if include_heatmap else None
+            results[i] = {
+                "file_name": files[i].filename,
+                "predicted_class": final_stage["predicted_class"],
+                "confidence": final_stage["confidence"],
+                "heatmap_url": blob_url(heatmap_blob)
+            }
+            if model == AUTO_MODEL:
+                results[i]["model"] = final_stage["model"]
+                results[i]["cascade_stages"] = stages[row]
+            records.append((i, {
+                "model_name": final_stage["model"],
+                "predicted_class": results[i]["predicted_class"],
+                "confidence": results[i]["confidence"],
+                "file_name": files[i].filename,
+                "file_size": len(contents_list[i]),
+                "file_type": file_type,
+                "image_blob": image_blob,
+                "heatmap_blob": heatmap_blob,
+                "thumb_blob": thumb_blob,
+                "cascade_stages": stages[row] if model == AUTO_MODEL else None
+            }))
+        
+        # Persist the whole batch in one transaction
+        with stage("batch_db_save", model=model):
+            prediction_ids = await _persist_predictions([record for _, record in records], wait=True)
+        for (i, _), prediction_id in zip(records, prediction_ids):
+            results[i]["prediction_id"] = prediction_id
+            if not include_heatmap:
+                results[i]["heatmap_url"] = f"/history/{prediction_id}/heatmap"
+                if explain == "lazy":
+                    background_tasks.add_task(_explain_later, _resolved(prediction_id), image_arrays[i])
+        
+        return JSONResponse(content={"model": model, "results": results})
+    except ServiceOverloaded:
+        raise
+    except Exception as e:
+        return JSONResponse(content={"error": str(e)}, status_code=500)
+
+
+def _parse_optional(name: str, value: Optional[str], parse):
+    """Parse an optional query parameter, treating blank form fields as absent"""
+    if value is None or not value.strip():
+        return None
+    try:
+        return parse(value.strip())
+    except ValueError:
+        raise HTTPException(status_code=422, detail=f"Invalid value for '{name}': {value}")
+
+
+def history_filters(model: Optional[str] = None, predicted_class: Optional[str] = None,
+                    min_confidence: Optional[str] = None, max_confidence: Optional[str] = None,
+                    start_date: Optional[str] = None, end_date: Optional[str] = None) -> dict:
+    """Query parameters filtering the prediction history"""
+    start = _parse_optional("start_date", start_date, date.fromisoformat)
+    end = _parse_optional("end_date", end_date, date.fromisoformat)
+    return {
+        "model_name": model or None,
+        "predicted_class": predicted_class or None,
+        "min_confidence": _parse_optional("min_confidence", min_confidence, float),
+        "max_confidence": _parse_optional("max_confidence", max_confidence, float),
+        "start_date": start.isoformat() if start else None,
+        "end_date": end.isoformat() if end else None
+    }
+
+
+def history_cursor(before_ts: Optional[str] = None, after_id: Optional[int] = None,
+                   after_ts: Optional[str] = None, before_id: Optional[int] = None) -> dict:
+    """Keyset cursor: before_ts/after_id pages to older rows, after_ts/before_id to newer rows"""
+    return {"before_ts": before_ts, "after_id": after_id, "after_ts": after_ts, "before_id": before_id}
+
+
+async def _history_page(page_size: int, cursor: dict, filters: dict, offset: int = 0):
+    """Fetch one history page and the cursors of its neighbouring pages"""
+    newer = cursor["after_ts"] is not None or cursor["before_id"] is not None
+    keyset = any(value is not None for value in cursor.values())
+    
+    # One extra row tells whether another page exists in the paging direction
+    rows = await db_executor.run(db.get_prediction_history, limit=page_size + 1,
+                                 offset=0 if keyset else offset, **cursor, **filters)
+    more = len(rows) > page_size
+    predictions = rows[-page_size:] if newer else rows[:page_size]
+    has_older = True if newer else more
+    has_newer = more if newer else (keyset or offset > 0)
+    
+    next_cursor = prev_cursor = None
+    if predictions and has_older:
+        next_cursor = {"before_ts": predictions[-1]["timestamp"], "after_id": predictions[-1]["id"]}
+    if predictions and has_newer:
+        prev_cursor = {"after_ts": predictions[0]["timestamp"], "before_id": predictions[0]["id"]}
+    return predictions, next_cursor, prev_cursor
+
+
 @app.get("/history", response_class=HTMLResponse)
-async def history(request: Request, page: int = Query(1, ge=1)):
-    """Display prediction history with pagination"""
+async def history(request: Request, page: int = Query(1, ge=1),
+                  cursor: dict = Depends(history_cursor), filters: dict = Depends(history_filters)):
+    """Display prediction history with keyset pagination"""
     page_size = 20
     offset = (page - 1) * page_size
     
-    predictions = db.get_prediction_history(limit=page_size, offset=offset)
-    statistics = db.get_prediction_statistics()
+    predictions, next_cursor, prev_cursor = await _history_page(page_size, cursor, filters, offset)
+    statistics = await db_executor.run(db.get_prediction_statistics)
+    
+    # Keep the active filters in the pagination links
+    filter_params = {key: value for key, value in request.query_params.items()
+                     if value and key not in ("page", *cursor.keys())}
+    next_url = prev_url = None
+    if next_cursor:
+        next_url = "/history?" + urlencode({**filter_params, "page": page + 1, **next_cursor})
+    if prev_cursor and page > 1:
+        prev_url = "/history?" + urlencode({**filter_params, "page": page - 1, **prev_cursor})
     
     return templates.TemplateResponse("history.html", {
         "request": request,
         "predictions": predictions,
         "statistics": statistics,
         "current_page": page,
-        "has_next": len(predictions) == page_size
+        "has_next": next_url is not None,
+        "next_url": next_url,
+        "prev_url": prev_url,
+        "filters": filter_params,
+        "models": CLASS_NAMES.keys()
+    })
+
+
+@app.get("/api/history")
+async def get_history(limit: int = Query(50, ge=1, le=500),
+                      cursor: dict = Depends(history_cursor), filters: dict = Depends(history_filters)):
+    """API endpoint to page through prediction history with keyset cursors"""
+    predictions, next_cursor, prev_cursor = await _history_page(limit, cursor, filters)
+    return JSONResponse(content={
+        "predictions": predictions,
+        "next_cursor": next_cursor,
+        "prev_cursor": prev_cursor
     })
 
 
 @app.get("/history/{prediction_id}")
 async def get_prediction_detail(prediction_id: int):
-    """Get detailed information about a specific prediction"""
-    prediction = db.get_prediction_by_id(prediction_id)
+    """Get detailed information about a specific prediction, with URLs of its images"""
+    prediction = await db_executor.run(db.get_prediction_by_id, prediction_id)
     if prediction:
+        base = f"/history/{prediction_id}"
+        prediction["image_url"] = f"{base}/image" if prediction["image_blob"] else None
+        prediction["heatmap_url"] = f"{base}/heatmap" if prediction["heatmap_blob"] or prediction["image_blob"] else None
+        prediction["thumbnail_url"] = f"{base}/thumbnail" if prediction["thumb_blob"] or prediction["image_blob"] else None
         return JSONResponse(content=prediction)
     return JSONResponse(content={"error": "Prediction not found"}, status_code=404)
 
 
+async def _blob_response(request: Request, digest: Optional[str], cache_control: str):
+    """Serve a stored blob with its digest as ETag, answering conditional requests with 304"""
+    blob_info = await db_executor.run(db.get_blob_info, digest) if digest and is_valid_digest(digest) else None
+    if blob_info is None or not await db_executor.run(db.blob_store.exists, digest):
+        return JSONResponse(content={"error": "Image not found"}, status_code=404)
+    
+    etag = f'"{digest}"'
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if_none_match = [tag.strip().removeprefix("W/") for tag in request.headers.get("if-none-match", "").split(",")]
+    if etag in if_none_match or "*" in if_none_match:
+        return Response(status_code=304, headers=headers)
+    file_path = db.blob_store.file_path(digest)
+    if file_path is None:
+        contents = await db_executor.run(db.blob_store.get, digest)
+        return Response(content=contents, media_type=blob_info['content_type'], headers=headers)
+    return FileResponse(file_path, media_type=blob_info['content_type'], headers=headers)
+
+
+async def _get_prediction_or_404(prediction_id: int) -> dict:
+    prediction = await db_executor.run(db.get_prediction_by_id, prediction_id)
+    if prediction is None:
+        raise HTTPException(status_code=404, detail="Prediction not found")
+    return prediction
+
+
+@app.get("/history/{prediction_id}/image")
+async def get_prediction_image(request: Request, prediction_id: int):
+    """Serve the uploaded image of a prediction"""
+    prediction = await _get_prediction_or_404(prediction_id)
+    return await _blob_response(request, prediction["image_blob"], f"public, max-age={IMAGE_CACHE_MAX_AGE}")
+
+
+@app.get("/history/{prediction_id}/heatmap")
+async def get_prediction_heatmap(request: Request, prediction_id: int):
+    """Serve the Grad-CAM overlay of a prediction, rendering it if it was deferred"""
+    prediction = await _get_prediction_or_404(prediction_id)
+    heatmap_blob = prediction["heatmap_blob"]
+    if heatmap_blob is None and prediction["image_blob"]:
+        # Explanations deferred at prediction time are rendered on first request and kept
+        heatmap_blob = await _ensure_heatmap(prediction_id)
+    return await _blob_response(request, heatmap_blob, f"public, max-age={IMAGE_CACHE_MAX_AGE}")
+
+
+@app.get("/history/{prediction_id}/thumbnail")
+async def get_prediction_thumbnail(request: Request, prediction_id: int):
+    """Serve the thumbnail of a prediction, creating it for rows saved before thumbnails existed"""
+    prediction = await _get_prediction_or_404(prediction_id)
+    thumb_blob = prediction["thumb_blob"]
+    if thumb_blob is None and prediction["image_blob"]:
+        contents = await db_executor.run(db.blob_store.get, prediction["image_blob"])
+        if contents is not None:
+            thumb_blob = await _store_thumbnail(contents)
+            if thumb_blob is not None:
+                await db_executor.run(db.set_prediction_blob, prediction_id, "thumb_blob", thumb_blob)
+    return await _blob_response(request, thumb_blob, f"public, max-age={IMAGE_CACHE_MAX_AGE}")
+
+
+@app.get("/blobs/{digest}")
+async def get_blob(request: Request, digest: str):
+    """Serve a stored image or heatmap by its content hash"""
+    # The URL names the content, so it never changes
+    return await _blob_response(request, digest, "public, max-age=31536000, immutable")
+
+
+def _with_highlights(disease: dict) -> dict:
+    """Copy a search result, escaping its highlights and turning the match markers into <mark> tags"""
+    disease = dict(disease)
+    for field in ("name_highlight", "snippet"):
+        if disease.get(field):
+            disease[field] = Markup(str(escape(disease[field]))
+                                    .replace(HIGHLIGHT_START, "<mark>").replace(HIGHLIGHT_END, "</mark>"))
+    return disease
+
+
 @app.get("/disease-guide", response_class=HTMLResponse)
 async def disease_guide(request: Request, search: Optional[str] = None):
     """Display disease guide with search functionality"""
-    diseases = db.get_disease_info(search)
+    diseases = [_with_highlights(disease) for disease in await db_executor.run(db.get_disease_info, search)]
     
     return templates.TemplateResponse("disease_guide.html", {
         "request": request,
@@ -183,6 +784,13 @@ async def disease_guide(request: Request, search: Optional[str] = None):
     })
 
 
+@app.get("/api/diseases/search")
+async def search_diseases(q: str = Query(..., min_length=1), limit: int = Query(20, ge=1, le=100)):
+    """API endpoint to search the disease guide, best matches first"""
+    results = await db_executor.run(db.search_disease_info, q, limit)
+    return JSONResponse(content={"query": q, "results": [_with_highlights(result) for result in results]})
+
+
 @app.get("/settings", response_class=HTMLResponse)
 async def settings(request: Request):
     """Display application settings"""
@@ -195,7 +803,18 @@ async def settings(request: Request):
 @app.get("/api/statistics")
 async def get_statistics():
     """API endpoint to get prediction statistics"""
-    return JSONResponse(content=db.get_prediction_statistics())
+    return JSONResponse(content=await db_executor.run(db.get_prediction_statistics))
+
+
+@app.get("/api/statistics/timeseries")
+async def get_statistics_timeseries(granularity: str = Query("day", pattern="^(day|hour)$"),
+                                    start_date: Optional[str] = None, end_date: Optional[str] = None):
+    """API endpoint to get prediction counts per day or hour"""
+    start = _parse_optional("start_date", start_date, date.fromisoformat)
+    end = _parse_optional("end_date", end_date, date.fromisoformat)
+    series = await db_executor.run(db.get_prediction_timeseries, granularity,
+                                   start.isoformat() if start else None, end.isoformat() if end else None)
+    return JSONResponse(content={"granularity": granularity, "series": series})
 
 
 @app.delete("/api/history/clear")
@@ -203,12 +822,7 @@ async def clear_history():
     """API endpoint to clear prediction history"""
     try:
         # Clear all predictions from database
-        import sqlite3
-        conn = sqlite3.connect(db.db_path)
-        cursor = conn.cursor()
-        cursor.execute('DELETE FROM predictions')
-        conn.commit()
-        conn.close()
+        await db_executor.run(db.clear_predictions)
         
         return JSONResponse(content={"message": "History cleared successfully"})
     except Exception as e:
@@ -219,84 +833,84 @@ async def clear_history():
 async def delete_prediction(prediction_id: int):
     """API endpoint to delete a specific prediction"""
     try:
-        import sqlite3
-        conn = sqlite3.connect(db.db_path)
-        cursor = conn.cursor()
-        cursor.execute('DELETE FROM predictions WHERE id = ?', (prediction_id,))
-        
-        if cursor.rowcount == 0:
+        if not await db_executor.run(db.delete_prediction, prediction_id):
             return JSONResponse(content={"error": "Prediction not found"}, status_code=404)
         
-        conn.commit()
-        conn.close()
-        
         return JSONResponse(content={"message": "Prediction deleted successfully"})
     except Exception as e:
         return JSONResponse(content={"error": str(e)}, status_code=500)
 
 
 @app.get("/api/history/export")
-async def export_history():
-    """API endpoint to export prediction history as CSV"""
-    try:
-        import csv
-        import io
-        from fastapi.responses import StreamingResponse
-        
-        predictions = db.get_prediction_history(limit=1000)
-        
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
-        # Write header
-        writer.writerow(['Date', 'Model', 'Prediction', 'Confidence', 'File Name', 'File Size', 'File Type'])
-        
-        # Write data
-        for pred in predictions:
-            writer.writerow([
-                pred['timestamp'],
-                pred['model_name'],
-                pred['predicted_class'],
-                pred['confidence'],
-                pred['file_name'],
-                pred['file_size'],
-                pred['file_type']
-            ])
-        
-        output.seek(0)
-        
-        return StreamingResponse(
-            io.BytesIO(output.getvalue().encode()),
-            media_type="text/csv",
-            headers={"Content-Disposition": "attachment; filename=prediction_history.csv"}
-        )
-    except Exception as e:
-        return JSONResponse(content={"error": str(e)}, status_code=500)
+async def export_history(format: str = Query("csv", pattern="^(csv|jsonl|parquet)$"),
+                         filters: dict = Depends(history_filters)):
+    """API endpoint to stream the full prediction history as CSV, JSON Lines or Parquet"""
+    if format == "parquet" and not parquet_available():
+        raise HTTPException(status_code=501, detail="Parquet export requires the pyarrow package")
+    encoder = EXPORT_ENCODERS[format]()
+    
+    async def fetch_chunk(after_ts, after_id):
+        return await db_executor.run(db.get_export_chunk, after_ts, after_id, **filters)
+    
+    return StreamingResponse(
+        stream_export(fetch_chunk, encoder),
+        media_type=encoder.media_type,
+        headers={"Content-Disposition": f"attachment; filename=prediction_history.{encoder.extension}"}
+    )
 
 
 @app.delete("/api/data/clear-all")
 async def clear_all_data():
     """API endpoint to clear all application data"""
     try:
-        import sqlite3
-        import os
-        
-        # Clear database
-        conn = sqlite3.connect(db.db_path)
-        cursor = conn.cursor()
-        cursor.execute('DELETE FROM predictions')
-        cursor.execute('DELETE FROM disease_info')
-        conn.commit()
-        conn.close()
-        
-        # Reinitialize disease info
-        db.populate_disease_info()
+        # Clear database and reinitialize disease info
+        await db_executor.run(db.clear_all_data)
+        result_cache.clear()
         
         return JSONResponse(content={"message": "All data cleared successfully"})
     except Exception as e:
         return JSONResponse(content={"error": str(e)}, status_code=500)
 
 
+@app.get("/api/inference/stats")
+async def get_inference_stats():
+    """API endpoint to get model registry and micro-batching statistics"""
+    return JSONResponse(content={
+        "registry": registry.stats(),
+        "schedulers": schedulers.stats(),
+        "executors": {
+            "cpu": cpu_executor.stats(),
+            "db": db_executor.stats()
+        },
+        "result_cache": result_cache.stats(),
+        "write_behind": prediction_writer.stats()
+    })
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus scrape endpoint with stage, request, query and cache metrics"""
+    if not metrics.enabled:
+        return JSONResponse(content={"error": "Metrics are disabled"}, status_code=404)
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/api/startup")
+async def get_startup_report():
+    """API endpoint to get where the last startup spent its time"""
+    return JSONResponse(content=startup_report)
+
+
+@app.post("/api/predictions/flush")
+async def flush_predictions():
+    """API endpoint to write every queued prediction to the database"""
+    # Only waits on the writer thread, so it stays off the database workers
+    flushed = await asyncio.to_thread(prediction_writer.flush, 30)
+    if not flushed:
+        return JSONResponse(content={"error": "Timed out while flushing queued predictions"}, status_code=504)
+    return JSONResponse(content={"message": "Queued predictions flushed", **prediction_writer.stats()})
+
+
 @app.get("/api/models/info")
 async def get_models_info():
     """API endpoint to get model information"""
@@ -0,0 +1,218 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import nullcontext
+from functools import wraps
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from config import METRICS_ENABLED, METRICS_LATENCY_BUCKETS, METRICS_PREFIX
+
+# One sample of a collector: (metric name, type, help, [(labels, value), ...])
+CollectedMetric = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+_DISABLED = nullcontext()
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, registry: "MetricsRegistry", name: str, help: str, labelnames: Sequence[str]):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonically increasing count per label set"""
+
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        if not self.registry.enabled:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Value that goes up and down per label set"""
+
+    type = "gauge"
+
+    def inc(self, amount: float = 1, **labels):
+        if not self.registry.enabled:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """Observation counts in cumulative buckets, plus their sum, per label set"""
+
+    type = "histogram"
+
+    def __init__(self, registry: "MetricsRegistry", name: str, help: str, labelnames: Sequence[str],
+                 buckets: Sequence[float] = METRICS_LATENCY_BUCKETS):
+        super().__init__(registry, name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        if not self.registry.enabled:
+            return
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # One slot per bucket, one for +Inf, then the sum
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def time(self, **labels) -> "_Timer":
+        """Context manager observing the duration of its block"""
+        return _Timer(self, labels)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            items = sorted((key, list(counts)) for key, counts in self._values.items())
+        for key, counts in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float('inf') else _format_value(bound)
+                labels = _format_labels(self.labelnames, key, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(counts[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'started')
+
+    def __init__(self, histogram: Histogram, labels: Dict[str, str]):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+class MetricsRegistry:
+    """Metrics of the process, rendered in the Prometheus text exposition format
+
+    When disabled, observations return immediately and ``stage`` hands out a
+    shared no-op context manager, so instrumented code pays next to nothing.
+    """
+
+    def __init__(self, enabled: bool = METRICS_ENABLED, prefix: str = METRICS_PREFIX):
+        self.enabled = enabled
+        self.prefix = prefix
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], Iterable[CollectedMetric]]] = []
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(self, self.prefix + name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._add(Gauge(self, self.prefix + name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = METRICS_LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(self, self.prefix + name, help, labelnames, buckets))
+
+    def add_collector(self, collector: Callable[[], Iterable[CollectedMetric]]):
+        """Register a callable reporting current values (queue depths, cache sizes...) at scrape time"""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            for name, metric_type, help, samples in collector():
+                lines.append(f"# HELP {self.prefix}{name} {help}")
+                lines.append(f"# TYPE {self.prefix}{name} {metric_type}")
+                for labels, value in samples:
+                    label_text = _format_labels(list(labels.keys()), list(labels.values()))
+                    lines.append(f"{self.prefix}{name}{label_text} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+
+# Global metrics registry instance
+metrics = MetricsRegistry()
+
+stage_seconds = metrics.histogram("stage_duration_seconds", "Time spent in a named processing stage",
+                                  ("stage", "model"))
+db_query_seconds = metrics.histogram("db_query_duration_seconds", "Time spent in a prediction database method",
+                                     ("query",))
+cache_lookups = metrics.counter("result_cache_lookups_total", "Prediction result cache lookups by outcome",
+                                ("model", "result"))
+
+
+def stage(name: str, model: Optional[str] = None):
+    """Time a block as the named stage: ``with stage("decode", model=model): ...``"""
+    if not metrics.enabled:
+        return _DISABLED
+    return stage_seconds.time(stage=name, model=model or "")
+
+
+def timed_query(method):
+    """Record the duration of a database method under its name"""
+    if not metrics.enabled:
+        return method
+
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            db_query_seconds.observe(time.perf_counter() - started, query=method.__name__)
+    return wrapper
@@ -0,0 +1,232 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+from backends import InferenceBackend, KerasBackend, backend_name, backend_path, load_tflite_backend
+from config import CLASS_NAMES, IMG_SIZE, MODEL_IDLE_TIMEOUT, MODEL_MEMORY_BUDGET_MB
+from metrics import stage
+from utils import GradCamEngine, get_model_path, load_selected_model
+
+logger = logging.getLogger(__name__)
+
+
+class _RegistryEntry:
+    """A loaded model together with its bookkeeping data"""
+
+    def __init__(self, model, size_bytes: int, version: str):
+        self.model = model
+        self.size_bytes = size_bytes
+        self.version = version
+        self.last_used = time.monotonic()
+        self.engine: Optional[GradCamEngine] = None
+        self.backend: Optional[KerasBackend] = None
+
+
+class ModelRegistry:
+    """Keep loaded Keras models in memory with LRU and idle-time eviction
+
+    Converted TFLite models selected in ``INFERENCE_BACKENDS`` are kept apart,
+    since only the Keras model is needed for Grad-CAM, but their interpreters
+    count against the same memory budget. Keras models are evicted first
+    (least recently used), then other models' TFLite backends.
+    """
+
+    def __init__(self, memory_budget_mb: float = MODEL_MEMORY_BUDGET_MB,
+                 idle_timeout: Optional[float] = MODEL_IDLE_TIMEOUT):
+        self.memory_budget = int(memory_budget_mb * 1024 * 1024)
+        self.idle_timeout = idle_timeout
+        self._entries: "OrderedDict[str, _RegistryEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks: Dict[str, threading.Lock] = {name: threading.Lock() for name in CLASS_NAMES}
+        # Model name -> (file version, backend, memory last accounted for)
+        self._backends: Dict[str, Tuple[str, InferenceBackend, int]] = {}
+        self._missing_backends = set()
+        self._counters = {'hits': 0, 'loads': 0, 'evictions': 0}
+
+    def get(self, model_name: str):
+        """Return the model, loading it from disk only when it is not resident"""
+        version = self.model_version(model_name)
+        with self._lock:
+            self._evict_idle()
+            model = self._lookup(model_name, version)
+        if model is not None:
+            return model
+
+        # Serialize loads of the same model so concurrent requests share one load
+        with self._load_locks.setdefault(model_name, threading.Lock()):
+            with self._lock:
+                model = self._lookup(model_name, version)
+            if model is not None:
+                return model
+
+            with stage("model_load", model=model_name):
+                model = load_selected_model(model_name)
+            entry = _RegistryEntry(model, self._estimate_size(model), version)
+
+            with self._lock:
+                self._entries[model_name] = entry
+                self._counters['loads'] += 1
+                self._enforce_budget(keep=model_name)
+            return model
+
+    def get_gradcam_engine(self, model_name: str) -> GradCamEngine:
+        """Return the cached Grad-CAM engine of a model, building it on first use"""
+        model = self.get(model_name)
+        with self._load_locks.setdefault(model_name, threading.Lock()):
+            with self._lock:
+                entry = self._entries.get(model_name)
+            if entry is None or entry.model is not model:
+                # Evicted in the meantime; serve this call without caching
+                return GradCamEngine(model)
+            if entry.engine is None:
+                entry.engine = GradCamEngine(model)
+            return entry.engine
+
+    def get_backend(self, model_name: str) -> InferenceBackend:
+        """Return the configured inference backend of a model
+
+        A TFLite backend whose converted file is missing falls back to Keras.
+        """
+        name = self._active_backend(model_name)
+        if name == "keras":
+            model = self.get(model_name)
+            with self._lock:
+                entry = self._entries.get(model_name)
+                if entry is None or entry.model is not model:
+                    return KerasBackend(model, backend_path(model_name, name))
+                if entry.backend is None:
+                    entry.backend = KerasBackend(model, backend_path(model_name, name))
+                return entry.backend
+
+        version = self._file_version(backend_path(model_name, name))
+        with self._lock:
+            cached = self._backends.get(model_name)
+        if cached is not None and cached[0] == version and cached[1].name == name:
+            backend = cached[1]
+            # The interpreter's buffers change size as it is resized between batch sizes
+            if backend.memory_bytes != cached[2]:
+                with self._lock:
+                    if self._backends.get(model_name) is cached:
+                        self._backends[model_name] = (version, backend, backend.memory_bytes)
+                        self._enforce_budget(keep=model_name)
+            return backend
+        with self._load_locks.setdefault(model_name, threading.Lock()):
+            with self._lock:
+                cached = self._backends.get(model_name)
+            if cached is not None and cached[0] == version and cached[1].name == name:
+                return cached[1]
+            with stage("model_load", model=model_name):
+                backend = load_tflite_backend(model_name, name)
+            with self._lock:
+                self._backends[model_name] = (version, backend, backend.memory_bytes)
+                self._counters['loads'] += 1
+                self._enforce_budget(keep=model_name)
+            return backend
+
+    def warmup(self, model_names: Iterable[str]):
+        """Load the given models and run one dummy forward pass through each"""
+        dummy = np.zeros((1,) + tuple(IMG_SIZE) + (3,), dtype=np.float32)
+        for model_name in model_names:
+            if not os.path.exists(get_model_path(model_name)):
+                logger.warning("Skipping warmup of '%s': model file not found", model_name)
+                continue
+            started = time.perf_counter()
+            self.get_backend(model_name).predict(dummy)
+            self.get_gradcam_engine(model_name)(dummy)
+            logger.info("Warmed up model '%s' in %.2fs", model_name, time.perf_counter() - started)
+
+    def evict(self, model_name: str) -> bool:
+        """Drop a model from memory, returning whether it was resident"""
+        with self._lock:
+            backend = self._backends.pop(model_name, None)
+            return self._entries.pop(model_name, None) is not None or backend is not None
+
+    def model_version(self, model_name: str) -> str:
+        """Identify the model file revision from its modification time and size"""
+        return self._file_version(get_model_path(model_name))
+
+    def inference_version(self, model_name: str) -> str:
+        """Identify what produces a model's predictions: its file revision and backend"""
+        name = self._active_backend(model_name)
+        if name == "keras":
+            return self.model_version(model_name)
+        return f"{self.model_version(model_name)}+{name}-{self._file_version(backend_path(model_name, name))}"
+
+    def stats(self) -> Dict:
+        """Return counters and the currently resident models"""
+        with self._lock:
+            return {
+                **self._counters,
+                'loaded_models': list(self._entries.keys()),
+                'tflite_backends': {name: backend.name for name, (_, backend, _) in self._backends.items()},
+                'memory_used_bytes': self._memory_used(),
+                'memory_budget_bytes': self.memory_budget,
+            }
+
+    def _active_backend(self, model_name: str) -> str:
+        name = backend_name(model_name)
+        if name != "keras" and not os.path.exists(backend_path(model_name, name)):
+            if model_name not in self._missing_backends:
+                self._missing_backends.add(model_name)
+                logger.warning("Backend '%s' of '%s' is not converted yet; using Keras", name, model_name)
+            return "keras"
+        return name
+
+    @staticmethod
+    def _file_version(path: str) -> str:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return ""
+        return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+    def _lookup(self, model_name: str, version: str):
+        entry = self._entries.get(model_name)
+        if entry is None or entry.version != version:
+            return None
+        entry.last_used = time.monotonic()
+        self._entries.move_to_end(model_name)
+        self._counters['hits'] += 1
+        return entry.model
+
+    def _evict_idle(self):
+        if self.idle_timeout is None:
+            return
+        deadline = time.monotonic() - self.idle_timeout
+        for name in [n for n, e in self._entries.items() if e.last_used < deadline]:
+            del self._entries[name]
+            self._counters['evictions'] += 1
+
+    def _memory_used(self) -> int:
+        return (sum(e.size_bytes for e in self._entries.values())
+                + sum(size for _, _, size in self._backends.values()))
+
+    def _enforce_budget(self, keep: str):
+        used = self._memory_used()
+        for name in list(self._entries.keys()):
+            if used <= self.memory_budget:
+                break
+            if name == keep:
+                continue
+            used -= self._entries.pop(name).size_bytes
+            self._counters['evictions'] += 1
+        for name in list(self._backends.keys()):
+            if used <= self.memory_budget:
+                break
+            if name == keep:
+                continue
+            used -= self._backends.pop(name)[2]
+            self._counters['evictions'] += 1
+
+    @staticmethod
+    def _estimate_size(model) -> int:
+        return int(sum(np.prod(w.shape) * np.dtype(w.dtype).itemsize for w in model.weights))
+
+
+# Global model registry instance
+registry = ModelRegistry()
@@ -0,0 +1,63 @@
+import io
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+import numpy as np
+from PIL import Image
+
+from config import DECODE_WORKERS, IMG_SIZE, THUMBNAIL_FORMAT, THUMBNAIL_QUALITY, THUMBNAIL_SIZE
+
+_decode_pool = ThreadPoolExecutor(max_workers=DECODE_WORKERS, thread_name_prefix="decode")
+
+
+def preprocess_image(contents: bytes) -> np.ndarray:
+    """Decode uploaded image bytes once into a normalized float32 (H, W, 3) array"""
+    image = Image.open(io.BytesIO(contents))
+    # Let the JPEG decoder downscale by 1/2, 1/4 or 1/8 while decoding (no-op for other formats)
+    image.draft("RGB", IMG_SIZE)
+    image = image.convert("RGB")
+    # reducing_gap shrinks large non-JPEG images with cheap box reduction before resampling
+    image = image.resize(IMG_SIZE, reducing_gap=3.0)
+    image_array = np.asarray(image, dtype=np.float32)
+    image_array *= 1.0 / 255.0  # Normalize the image
+    return image_array
+
+
+def make_thumbnail(contents: bytes) -> bytes:
+    """Encode a small preview of uploaded image bytes for the history views"""
+    image = Image.open(io.BytesIO(contents))
+    image.draft("RGB", THUMBNAIL_SIZE)
+    image = image.convert("RGB")
+    image.thumbnail(THUMBNAIL_SIZE, reducing_gap=3.0)
+    output = io.BytesIO()
+    image.save(output, format=THUMBNAIL_FORMAT, quality=THUMBNAIL_QUALITY)
+    return output.getvalue()
+
+
+def thumbnail_content_type() -> str:
+    Image.init()
+    return Image.MIME[THUMBNAIL_FORMAT]
+
+
+def _try_preprocess(contents: bytes) -> Optional[np.ndarray]:
+    try:
+        return preprocess_image(contents)
+    except Exception:
+        return None
+
+
+def preprocess_images(contents_list: List[bytes]) -> List[Optional[np.ndarray]]:
+    """Decode many uploads in parallel; undecodable images yield None"""
+    return list(_decode_pool.map(_try_preprocess, contents_list))
+
+
+def _try_thumbnail(contents: bytes) -> Optional[bytes]:
+    try:
+        return make_thumbnail(contents)
+    except Exception:
+        return None
+
+
+def make_thumbnails(contents_list: List[bytes]) -> List[Optional[bytes]]:
+    """Encode the thumbnails of many uploads in parallel; undecodable images yield None"""
+    return list(_decode_pool.map(_try_thumbnail, contents_list))
@@ -0,0 +1,127 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional
+
+from config import RESULT_CACHE_PERSISTENT, RESULT_CACHE_SIZE
+from database import PredictionDatabase, db
+from metrics import cache_lookups
+
+
+class CacheKey(NamedTuple):
+    image_hash: str
+    model_name: str
+    model_version: str
+
+
+class PredictionResultCache:
+    """Content-addressed cache of prediction results
+
+    Results are keyed by the SHA-256 of the uploaded bytes, the model name and
+    the model file version, so a retrained model never serves stale results.
+    An in-memory LRU tier sits in front of an optional persistent tier stored in
+    the prediction database.
+    """
+
+    def __init__(self, database: PredictionDatabase, max_entries: int = RESULT_CACHE_SIZE,
+                 persistent: bool = RESULT_CACHE_PERSISTENT):
+        self.db = database
+        self.max_entries = max_entries
+        self.persistent = persistent
+        self._entries: "OrderedDict[CacheKey, Dict]" = OrderedDict()
+        self._versions: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._counters = {'memory_hits': 0, 'persistent_hits': 0, 'misses': 0, 'invalidations': 0}
+
+    @staticmethod
+    def make_key(contents: bytes, model_name: str, model_version: str) -> CacheKey:
+        return CacheKey(hashlib.sha256(contents).hexdigest(), model_name, model_version)
+
+    def get(self, key: CacheKey) -> Optional[Dict]:
+        """Return the cached result (predicted_class, confidence, heatmap_blob) or None"""
+        self._check_version(key)
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+                self._counters['memory_hits'] += 1
+                cache_lookups.inc(model=key.model_name, result='memory')
+                return result
+
+        if self.persistent:
+            result = self.db.get_cached_result(*key)
+            if result is not None:
+                self._remember(key, result)
+                with self._lock:
+                    self._counters['persistent_hits'] += 1
+                cache_lookups.inc(model=key.model_name, result='persistent')
+                return result
+
+        with self._lock:
+            self._counters['misses'] += 1
+        cache_lookups.inc(model=key.model_name, result='miss')
+        return None
+
+    def put(self, key: CacheKey, predicted_class: str, confidence: float, heatmap_blob: Optional[str] = None):
+        """Store a freshly computed result in every enabled tier"""
+        result = {
+            'predicted_class': predicted_class,
+            'confidence': float(confidence),
+            'heatmap_blob': heatmap_blob
+        }
+        self._remember(key, result)
+        if self.persistent:
+            self.db.save_cached_result(*key, **result)
+
+    def attach_heatmap(self, key: CacheKey, predicted_class: str, heatmap_blob: str):
+        """Add a heatmap rendered after the fact to a cached result of the same class"""
+        with self._lock:
+            result = self._entries.get(key)
+        if result is None and self.persistent:
+            result = self.db.get_cached_result(*key)
+        if result is not None and result['predicted_class'] == predicted_class and not result['heatmap_blob']:
+            self.put(key, predicted_class, result['confidence'], heatmap_blob)
+
+    def invalidate(self, model_name: str, keep_version: Optional[str] = None):
+        """Drop every cached result of a model except those of ``keep_version``"""
+        with self._lock:
+            for key in [k for k in self._entries if k.model_name == model_name and k.model_version != keep_version]:
+                del self._entries[key]
+            self._counters['invalidations'] += 1
+        if self.persistent:
+            self.db.delete_cached_results(model_name, keep_version)
+
+    def clear(self):
+        """Forget every in-memory entry (the persistent tier is cleared with the database)"""
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            hits = self._counters['memory_hits'] + self._counters['persistent_hits']
+            lookups = hits + self._counters['misses']
+            return {
+                **self._counters,
+                'entries': len(self._entries),
+                'hit_rate': round(hits / lookups, 4) if lookups else 0.0
+            }
+
+    def _remember(self, key: CacheKey, result: Dict):
+        with self._lock:
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _check_version(self, key: CacheKey):
+        # A new model file version makes results of older versions unreachable; purge them
+        with self._lock:
+            previous = self._versions.get(key.model_name)
+            self._versions[key.model_name] = key.model_version
+        if previous is not None and previous != key.model_version:
+            self.invalidate(key.model_name, keep_version=key.model_version)
+
+
+# Global result cache instance
+result_cache = PredictionResultCache(db)
@@ -67,16 +67,16 @@ function showPredictionModal(prediction) {
     const modalContent = `
         <div class="prediction-detail">
             <div class="detail-images">
-                ${prediction.image_data ? `
+                ${prediction.image_url ? `
                     <div class="image-section">
                         <h4>Original Image</h4>
-                        <img src="${prediction.image_data}" alt="Original image" class="detail-image">
+                        <img src="${prediction.image_url}" alt="Original image" class="detail-image">
                     </div>
                 ` : ''}
-                ${prediction.heatmap_data ? `
+                ${prediction.heatmap_url ? `
                     <div class="image-section">
                         <h4>Heatmap Analysis</h4>
-                        <img src="${prediction.heatmap_data}" alt="Heatmap analysis" class="detail-image">
+                        <img src="${prediction.heatmap_url}" alt="Heatmap analysis" class="detail-image">
                     </div>
                 ` : ''}
             </div>
@@ -1,15 +1,53 @@
 
 
+import importlib
 import math
-import cv2
+import threading
 from fastapi import HTTPException
-import tensorflow as tf
 import numpy as np
 import os
 
+from config import HEATMAP_FORMAT, HEATMAP_PNG_COMPRESSION, HEATMAP_QUALITY, IMG_SIZE
+
+
+class LazyModule:
+    """Module proxy that imports the real module on first attribute access
+
+    TensorFlow and OpenCV take seconds to import; deferring them keeps
+    processes that never run inference quick to start.
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+    @property
+    def loaded(self) -> bool:
+        return self._module is not None
+
+
+cv2 = LazyModule('cv2')
+tf = LazyModule('tensorflow')
+
+# Function to resolve the on-disk path of a model
+def get_model_path(model_name: str):
+    return os.path.join(os.path.dirname(__file__), 'models', f'{model_name}.keras')
+
+# Function to resolve the on-disk path of a converted TFLite model variant
+def get_tflite_path(model_name: str, variant: str):
+    return os.path.join(os.path.dirname(__file__), 'models', f'{model_name}.{variant}.tflite')
+
 # Function to load the selected model
 def load_selected_model(model_name: str):
-    model_path = os.path.join(os.path.dirname(__file__), 'models', f'{model_name}.keras')
+    model_path = get_model_path(model_name)
     if not os.path.exists(model_path):
         raise HTTPException(status_code=404, detail=f"Model '{model_name}' not found.")
     try:
@@ -17,71 +55,150 @@ def load_selected_model(model_name: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to load model '{model_name}': {str(e)}")
 
-def generate_gradcam(model, img_array, pred_index=None):
-    """Generate Grad-CAM heatmap for the given image using the specified model."""
-    # Create a model that maps the input image to the activations of the last conv layer
-    last_conv_layer = next(layer for layer in reversed(model.layers) 
-                           if isinstance(layer, tf.keras.layers.Conv2D))
-    last_conv_layer_model = tf.keras.Model(model.inputs, last_conv_layer.output)
-    
-    # Create a model that maps the activations of the last conv layer to the final class predictions
-    classifier_input = tf.keras.Input(shape=last_conv_layer.output.shape[1:])
-    x = classifier_input
-    for layer in model.layers[model.layers.index(last_conv_layer) + 1:]:
-        x = layer(x)
-    classifier_model = tf.keras.Model(classifier_input, x)
-    
-    # Watch the gradients
-    with tf.GradientTape() as tape:
-        # Compute activations of the last conv layer and make the tape watch it
-        last_conv_layer_output = last_conv_layer_model(img_array)
-        tape.watch(last_conv_layer_output)
-        # Compute class predictions
-        preds = classifier_model(last_conv_layer_output)
+class GradCamEngine:
+    """Grad-CAM sub-graphs built once per model, traced into a single tf.function"""
+
+    def __init__(self, model):
+        self.model = model
+        # Create a model that maps the input image to the activations of the last conv layer
+        last_conv_layer = next(layer for layer in reversed(model.layers)
+                               if isinstance(layer, tf.keras.layers.Conv2D))
+        self.last_conv_layer_model = tf.keras.Model(model.inputs, last_conv_layer.output)
+
+        # Create a model that maps the activations of the last conv layer to the final class predictions
+        classifier_input = tf.keras.Input(shape=last_conv_layer.output.shape[1:])
+        x = classifier_input
+        for layer in model.layers[model.layers.index(last_conv_layer) + 1:]:
+            x = layer(x)
+        self.classifier_model = tf.keras.Model(classifier_input, x)
+
+        self._explain = tf.function(
+            self._forward_backward,
+            input_signature=[
+                tf.TensorSpec(shape=(None,) + tuple(IMG_SIZE) + (3,), dtype=tf.float32),
+                tf.TensorSpec(shape=(None,), dtype=tf.int32),
+            ],
+        )
+
+    def _forward_backward(self, img_array, pred_index):
+        with tf.GradientTape() as tape:
+            last_conv_layer_output = self.last_conv_layer_model(img_array, training=False)
+            tape.watch(last_conv_layer_output)
+            preds = self.classifier_model(last_conv_layer_output, training=False)
+            # A negative index selects the top predicted class of each sample
+            top_index = tf.argmax(preds, axis=-1, output_type=tf.int32)
+            pred_index = tf.where(pred_index < 0, top_index, pred_index)
+            class_channel = tf.gather(preds, pred_index, axis=1, batch_dims=1)
+
+        # Gradient of the target class with regard to the output feature map
+        grads = tape.gradient(class_channel, last_conv_layer_output)
+
+        # Mean intensity of the gradient over each channel, per sample
+        pooled_grads = tf.reduce_mean(grads, axis=(1, 2))
+
+        # Weight the channels by the pooled gradients and average them
+        channels = tf.cast(tf.shape(last_conv_layer_output)[-1], last_conv_layer_output.dtype)
+        heatmaps = tf.einsum('bhwc,bc->bhw', last_conv_layer_output, pooled_grads) / channels
+        return preds, heatmaps
+
+    def __call__(self, img_array, pred_index=None):
+        """Return (predictions, raw heatmaps) from one forward and backward pass"""
+        img_array = tf.convert_to_tensor(img_array, dtype=tf.float32)
         if pred_index is None:
-            pred_index = tf.argmax(preds[0])
-        # This is the output we want to maximize
-        class_channel = preds[:, pred_index]
-    
-    # Gradient of the target class with regard to the output feature map
-    grads = tape.gradient(class_channel, last_conv_layer_output)
-    
-    # Vector where each entry is the mean intensity of the gradient over a channel
-    pooled_grads = tf.reduce_mean(grads, axis=(0, 1, 2))
-    
-    # Weight the channels by the computed gradient values
-    last_conv_layer_output = last_conv_layer_output.numpy()[0]
-    pooled_grads = pooled_grads.numpy()
-    for i in range(pooled_grads.shape[-1]):
-        last_conv_layer_output[:, :, i] *= pooled_grads[i]
-    
-    # Average over all channels
-    heatmap = np.mean(last_conv_layer_output, axis=-1)
-    
-    # ReLU thresholding
-    heatmap = np.maximum(heatmap, 0) / np.max(heatmap)
-    
-    return heatmap
+            pred_index = -1
+        pred_index = tf.broadcast_to(tf.cast(pred_index, tf.int32), tf.shape(img_array)[:1])
+        preds, heatmaps = self._explain(img_array, pred_index)
+        return preds.numpy(), heatmaps.numpy()
+
+
+def generate_gradcam(model, img_array, pred_index=None):
+    """Generate Grad-CAM heatmap for the first image using the specified model or engine."""
+    return generate_gradcam_batch(model, img_array, pred_index)[0]
+
+def generate_gradcam_batch(model, img_array, pred_indices=None):
+    """Generate normalized Grad-CAM heatmaps for every image of the batch."""
+    engine = model if isinstance(model, GradCamEngine) else GradCamEngine(model)
+    _, heatmaps = engine(img_array, pred_indices)
+    return normalize_heatmap(heatmaps)
+
+def normalize_heatmap(heatmap):
+    """ReLU threshold raw Grad-CAM heatmaps and scale each one to [0, 1]."""
+    heatmap = np.maximum(heatmap, 0)
+    # Per-sample maximum; an all-zero heatmap stays zero instead of becoming NaN
+    peak = np.max(heatmap, axis=(-2, -1), keepdims=True)
+    return np.divide(heatmap, peak, out=np.zeros_like(heatmap), where=peak > 0)
+
+# Lookup table equivalent to cv2.applyColorMap(..., cv2.COLORMAP_JET)
+_JET_LUT = None
+
+def _jet_lut():
+    global _JET_LUT
+    if _JET_LUT is None:
+        _JET_LUT = cv2.applyColorMap(np.arange(256, dtype=np.uint8).reshape(256, 1), cv2.COLORMAP_JET)[:, 0, :]
+    return _JET_LUT
+
+def _resize_batch(heatmaps, width, height):
+    """Resize a (batch, h, w) stack with cv2 by treating the batch as channels."""
+    resized = []
+    # cv2 handles at most 512 channels per call
+    for start in range(0, heatmaps.shape[0], 512):
+        chunk = np.ascontiguousarray(np.moveaxis(heatmaps[start:start + 512], 0, -1))
+        chunk = cv2.resize(chunk, (width, height))
+        resized.append(chunk.reshape(height, width, -1))
+    return np.moveaxis(np.concatenate(resized, axis=-1), -1, 0)
 
 def apply_heatmap(img_array, heatmap, alpha=0.4):
-    """Apply the heatmap over the original image."""
-    # Resize heatmap to match image dimensions
-    heatmap = cv2.resize(heatmap, (img_array.shape[2], img_array.shape[1]))
+    """Apply the heatmap over the original image.
+
+    A single (h, w) heatmap is overlaid on the first image and one image is
+    returned; a (batch, h, w) stack is overlaid on the whole batch.
+    """
+    single = heatmap.ndim == 2
+    heatmaps = heatmap[np.newaxis] if single else heatmap
+    images = img_array[:heatmaps.shape[0]]
+    
+    # Resize heatmaps to match image dimensions
+    heatmaps = _resize_batch(heatmaps.astype(np.float32), images.shape[2], images.shape[1])
     
-    # Convert heatmap to RGB
-    heatmap = np.uint8(255 * heatmap)
-    heatmap = cv2.applyColorMap(heatmap, cv2.COLORMAP_JET)
+    # Convert heatmaps to RGB
+    heatmaps = _jet_lut()[np.uint8(255 * heatmaps)]
     
-    # Convert original image from preprocessing format to RGB for overlay
-    orig_img = (img_array[0] * 255).astype(np.uint8)
-    if orig_img.shape[-1] == 1:  # If grayscale
-        orig_img = cv2.cvtColor(orig_img, cv2.COLOR_GRAY2RGB)
+    # Convert original images from preprocessing format to RGB for overlay
+    orig_imgs = (images * 255).astype(np.uint8)
+    if orig_imgs.shape[-1] == 1:  # If grayscale
+        orig_imgs = np.repeat(orig_imgs, 3, axis=-1)
     
-    # Superimpose the heatmap on original image
-    superimposed_img = heatmap * alpha + orig_img
-    superimposed_img = np.clip(superimposed_img, 0, 255).astype(np.uint8)
+    # Superimpose the heatmaps on original images
+    superimposed_imgs = heatmaps * alpha + orig_imgs
+    superimposed_imgs = np.clip(superimposed_imgs, 0, 255).astype(np.uint8)
     
-    return superimposed_img
+    return superimposed_imgs[0] if single else superimposed_imgs
+
+# File extension and content type of each heatmap format
+HEATMAP_FORMATS = {
+    'PNG': ('.png', 'image/png'),
+    'JPEG': ('.jpg', 'image/jpeg'),
+    'WEBP': ('.webp', 'image/webp'),
+}
+
+def encode_heatmap(superimposed_img, image_format=HEATMAP_FORMAT):
+    """Encode a superimposed heatmap image with OpenCV in the configured format."""
+    extension, _ = HEATMAP_FORMATS[image_format]
+    if image_format == 'PNG':
+        params = [cv2.IMWRITE_PNG_COMPRESSION, HEATMAP_PNG_COMPRESSION]
+    elif image_format == 'JPEG':
+        params = [cv2.IMWRITE_JPEG_QUALITY, HEATMAP_QUALITY]
+    else:
+        params = [cv2.IMWRITE_WEBP_QUALITY, HEATMAP_QUALITY]
+    # OpenCV expects BGR channel order
+    success, encoded = cv2.imencode(extension, cv2.cvtColor(superimposed_img, cv2.COLOR_RGB2BGR), params)
+    if not success:
+        raise ValueError(f"Could not encode heatmap as {image_format}")
+    return encoded.tobytes()
+
+def heatmap_content_type(image_format=HEATMAP_FORMAT):
+    """Content type of heatmaps encoded by encode_heatmap."""
+    return HEATMAP_FORMATS[image_format][1]
 
 # Helper function to format file size
 def format_file_size(bytes):
@@ -0,0 +1,138 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Optional
+
+from config import WRITE_BEHIND_ENABLED, WRITE_BEHIND_FLUSH_MS, WRITE_BEHIND_MAX_BATCH
+from database import PredictionDatabase, db
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class _FlushRequest:
+    """Queue marker resolved once every record queued before it is written"""
+
+    def __init__(self):
+        self.done = threading.Event()
+
+
+class PredictionWriter:
+    """Queue prediction records and insert them in batched transactions
+
+    A background thread writes whatever is queued once ``max_batch`` records
+    are waiting or the oldest one has waited ``flush_ms``. ``submit`` returns a
+    future that resolves to the prediction id after its batch is committed.
+    Records submitted together with ``submit_many`` are never split across
+    transactions.
+    """
+
+    def __init__(self, database: PredictionDatabase, enabled: bool = WRITE_BEHIND_ENABLED,
+                 max_batch: int = WRITE_BEHIND_MAX_BATCH, flush_ms: float = WRITE_BEHIND_FLUSH_MS):
+        self.db = database
+        self.enabled = enabled
+        self.max_batch = max_batch
+        self.flush_interval = flush_ms / 1000.0
+        self._queue: "queue.Queue" = queue.Queue()
+        self._worker: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._counters = {'written': 0, 'failed': 0, 'batches': 0, 'last_batch_size': 0, 'last_flush_ms': 0.0}
+
+    def submit(self, record: Dict) -> Future:
+        """Queue one record (as accepted by save_predictions) and return a future for its id"""
+        return self.submit_many([record])[0]
+
+    def submit_many(self, records: List[Dict]) -> List[Future]:
+        """Queue records to be written in the same transaction and return a future for each id"""
+        self._ensure_started()
+        futures = [Future() for _ in records]
+        self._queue.put((records, futures))
+        return futures
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Block until every record queued so far is written; False on timeout"""
+        if self._worker is None:
+            return True
+        request = _FlushRequest()
+        self._queue.put(request)
+        return request.done.wait(timeout)
+
+    def close(self):
+        """Write everything still queued and stop the background writer"""
+        with self._start_lock:
+            worker, self._worker = self._worker, None
+        if worker is not None:
+            self._queue.put(_STOP)
+            worker.join()
+
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            return {**self._counters, 'enabled': self.enabled, 'queue_depth': self._queue.qsize()}
+
+    def _ensure_started(self):
+        with self._start_lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="prediction-writer", daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        pending: List = []
+        pending_records = 0
+        flush_requests: List[_FlushRequest] = []
+        deadline = None
+        stopping = False
+        while not stopping:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is _STOP:
+                stopping = True
+            elif isinstance(item, _FlushRequest):
+                flush_requests.append(item)
+            elif item is not None:
+                pending.append(item)
+                pending_records += len(item[0])
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+
+            due = deadline is not None and time.monotonic() >= deadline
+            # Whole submissions only, so a batch may exceed max_batch by its last submission
+            if pending and (stopping or flush_requests or due or pending_records >= self.max_batch):
+                self._write(pending)
+                pending, pending_records, deadline = [], 0, None
+            for request in flush_requests:
+                request.done.set()
+            flush_requests = []
+
+    def _write(self, pending: List):
+        started = time.perf_counter()
+        records = [record for submitted, _ in pending for record in submitted]
+        futures = [future for _, submitted in pending for future in submitted]
+        try:
+            prediction_ids = self.db.save_predictions(records)
+        except Exception as e:
+            logger.exception("Failed to write %d queued predictions", len(records))
+            with self._stats_lock:
+                self._counters['failed'] += len(records)
+            for future in futures:
+                future.set_exception(e)
+            return
+
+        for future, prediction_id in zip(futures, prediction_ids):
+            future.set_result(prediction_id)
+        with self._stats_lock:
+            self._counters['written'] += len(records)
+            self._counters['batches'] += 1
+            self._counters['last_batch_size'] = len(records)
+            self._counters['last_flush_ms'] = round((time.perf_counter() - started) * 1000, 2)
+
+
+# Global write-behind writer instance
+prediction_writer = PredictionWriter(db)